@@ -0,0 +1,85 @@
+"""
+Small in-process LRU cache with optional expiry
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Bounded mapping with least-recently-used eviction and optional expiry.
+
+    With sliding=True the expiry is an idle timeout that restarts on every
+    access; otherwise entries expire a fixed time after they were stored.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None, sliding: bool = False):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sliding = sliding
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, list]" = OrderedDict()  # key -> [value, expires_at]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._entries.get(key)
+        return item is not None and not self._expired(item, time.monotonic())
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        item = self._entries.get(key)
+        if item is None or self._expired(item, now):
+            if item is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        if self.sliding:
+            item[1] = self._expires_at(now)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key: Hashable, value: Any):
+        now = time.monotonic()
+        self._entries[key] = [value, self._expires_at(now)]
+        self._entries.move_to_end(key)
+        self._evict(now)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._entries.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self, now: float):
+        # The least recently used entries sit at the front, so idle entries
+        # are found there first
+        while self._entries:
+            key, item = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and not self._expired(item, now):
+                break
+            del self._entries[key]
+            self.evictions += 1
+
+    def _expires_at(self, now: float) -> Optional[float]:
+        return None if self.ttl_seconds is None else now + self.ttl_seconds
+
+    @staticmethod
+    def _expired(item: list, now: float) -> bool:
+        return item[1] is not None and item[1] <= now
@@ -0,0 +1,63 @@
+"""
+Due-time index for periodic check-ins.
+
+A min-heap of (due_at, entry_id) with lazy deletion: rescheduling or
+cancelling an entry only updates the entry -> deadline map, and stale heap
+items are skipped when they reach the top. The heap is rebuilt when stale
+items outnumber live ones, so it stays O(live entries).
+"""
+
+import heapq
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class CheckInSchedule:
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int]] = []
+        self._due: Dict[int, datetime] = {}  # entry_id -> current deadline
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, entry_id: int, due_at: datetime):
+        """Set an entry's next check-in, replacing any earlier deadline"""
+        self._due[entry_id] = due_at
+        heapq.heappush(self._heap, (due_at, entry_id))
+        self._compact()
+
+    def cancel(self, entry_id: int):
+        self._due.pop(entry_id, None)
+        self._compact()
+
+    def due_at(self, entry_id: int) -> Optional[datetime]:
+        return self._due.get(entry_id)
+
+    def next_due(self) -> Optional[datetime]:
+        """Earliest live deadline, or None when nothing is scheduled"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, until: datetime) -> List[int]:
+        """Remove and return every entry due at or before until, earliest first"""
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > until:
+                return due
+            _, entry_id = heapq.heappop(self._heap)
+            del self._due[entry_id]
+            due.append(entry_id)
+
+    def clear(self):
+        self._heap = []
+        self._due = {}
+
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._due) + 16:
+            self._heap = [(due_at, entry_id) for entry_id, due_at in self._due.items()]
+            heapq.heapify(self._heap)
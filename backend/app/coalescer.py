@@ -0,0 +1,68 @@
+"""
+Coalescing of bursty broadcast requests
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class Coalescer:
+    """Merge requests made within a short window into one call of flush.
+
+    Each request restarts a window_seconds quiet period, but a flush never
+    waits more than max_staleness_seconds after the first request it covers.
+    Requests made while a flush is running start the next batch.
+    """
+
+    def __init__(self, flush: Callable[[], Awaitable[None]], window_seconds: float, max_staleness_seconds: float):
+        self._flush = flush
+        self.window_seconds = window_seconds
+        self.max_staleness_seconds = max(max_staleness_seconds, window_seconds)
+        self._task: Optional[asyncio.Task] = None
+        self._first_at = 0.0
+        self._last_at = 0.0
+        self._pending = 0
+        self.requests = 0
+        self.flushes = 0
+        self.max_batch = 0
+        self.total_delay = 0.0
+
+    def request(self):
+        """Ask for a flush; returns immediately"""
+        now = time.monotonic()
+        self.requests += 1
+        if not self._pending:
+            self._first_at = now
+        self._pending += 1
+        self._last_at = now
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self._pending:
+            while True:
+                deadline = min(self._last_at + self.window_seconds, self._first_at + self.max_staleness_seconds)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+
+            batch, self._pending = self._pending, 0
+            self.flushes += 1
+            self.max_batch = max(self.max_batch, batch)
+            self.total_delay += time.monotonic() - self._first_at
+            try:
+                await self._flush()
+            except Exception as e:
+                print(f"Coalesced flush failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "flushes": self.flushes,
+            "merged": self.requests - self.flushes - self._pending,
+            "pending": self._pending,
+            "max_batch": self.max_batch,
+            "mean_delay_ms": round(self.total_delay / self.flushes * 1000, 1) if self.flushes else 0.0,
+        }
@@ -0,0 +1,281 @@
+"""
+WebSocket connections with per-connection outbound queues.
+
+Every socket gets a bounded queue drained by its own writer task, so a
+broadcast only enqueues and one slow client cannot hold up the others.
+When a client's queue is full, WS_SLOW_CONSUMER_POLICY decides what
+happens to further queue updates:
+- "drop": discard them; the client sees a seq gap and asks for a resync
+- "coalesce": replace the queued queue updates with one fresh snapshot
+- "disconnect": close the socket so the client reconnects and starts over
+Personal messages (chat chunks, check-ins) are never dropped or merged.
+
+Patients subscribe to their own view ("me"): a small queue_position
+message sent only when their position changes. The full queue deltas
+("full") of one department are for staff and must present STAFF_API_TOKEN;
+with no token configured they are refused unless STAFF_API_OPEN is set. A department's broadcast only visits
+that department's staff and the patients waiting in it (or not yet in
+any queue). For personal views, drop and coalesce both keep only the
+newest queued view.
+
+Queue updates arrive already encoded, so a broadcast shares one JSON text
+between all connections.
+
+With several workers, a personal message for a session whose socket is
+held by another worker goes out on the event bus as a session_message,
+and the worker holding the socket delivers it.
+"""
+
+import asyncio
+import os
+import secrets
+import uuid
+from collections import Counter, deque
+from typing import Callable, Dict, Optional
+from fastapi import WebSocket
+from app.encoding import dumps
+from app.event_bus import EventBus
+
+WS_SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", "32"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce").lower()
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))  # A stuck send drops the client
+
+STAFF_API_TOKEN = os.getenv("STAFF_API_TOKEN")  # Unset: staff views and actions are refused
+# Development only: with no STAFF_API_TOKEN, let anyone act as staff
+STAFF_API_OPEN = os.getenv("STAFF_API_OPEN", "").lower() in ("1", "true", "yes")
+
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+FULL_VIEW = "full"
+PERSONAL_VIEW = "me"
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_NORMAL = 1000
+
+
+def is_staff(token: Optional[str]) -> bool:
+    """Whether a request may see the full queue or act on it"""
+    if not STAFF_API_TOKEN:
+        return STAFF_API_OPEN
+    return token is not None and secrets.compare_digest(token, STAFF_API_TOKEN)
+
+
+class Connection:
+    def __init__(self, session_id: str, websocket: WebSocket, view: str, user_id: Optional[int],
+                 department: Optional[str]):
+        self.id = uuid.uuid4().hex  # Tells this connection apart from a later one for the same session
+        self.session_id = session_id
+        self.websocket = websocket
+        self.view = view
+        self.user_id = user_id
+        self.department = department  # Queue subscribed to (full) or waited in (me)
+        self.last_view: Optional[Dict] = None  # Last personal view queued
+        self.pending: deque = deque()  # (is queue update, encoded message)
+        self.ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.stopped = False  # Set when the writer must exit
+
+
+class ConnectionManager:
+    def __init__(self, snapshot: Callable[[str], str], bus: Optional[EventBus] = None,
+                 max_pending: int = WS_SEND_QUEUE_MAX, policy: str = WS_SLOW_CONSUMER_POLICY,
+                 send_timeout: float = WS_SEND_TIMEOUT_SECONDS):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(
+                f"Unknown WS_SLOW_CONSUMER_POLICY '{policy}'. Use one of: {', '.join(SLOW_CONSUMER_POLICIES)}"
+            )
+        self.active_connections: Dict[str, Connection] = {}
+        self.snapshot = snapshot  # Current encoded queue_snapshot of a department, used to coalesce
+        self.bus = bus
+        if bus is not None:
+            bus.subscribe("session_message", self._receive_personal_message)
+        self.max_pending = max_pending
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self.send_failures = 0
+        self.closing: set = set()  # Tasks finishing off dropped connections
+
+    async def connect(self, websocket: WebSocket, session_id: str, view: str = PERSONAL_VIEW,
+                      user_id: Optional[int] = None, department: Optional[str] = None) -> Connection:
+        await websocket.accept()
+        previous = self.active_connections.get(session_id)
+        if previous is not None:
+            # Close the replaced socket too, so its receive loop ends now rather than when the client goes
+            self._stop(previous)
+            self._finish(previous, "Replaced by a newer connection", CLOSE_NORMAL)
+        connection = Connection(session_id, websocket, view, user_id, department)
+        connection.writer = asyncio.ensure_future(self._write(connection))
+        self.active_connections[session_id] = connection
+        return connection
+
+    async def disconnect(self, session_id: str, websocket: Optional[WebSocket] = None) -> bool:
+        """Forget a session's connection; with websocket, only if it is still the current one.
+
+        Returns whether a connection was removed.
+        """
+        connection = self._detach(session_id, websocket)
+        if connection is None:
+            return False
+        await self._stopped([connection])
+        return True
+
+    async def shutdown(self):
+        """Stop every writer and wait for it and any pending closes to finish"""
+        connections = list(self.active_connections.values())
+        self.active_connections.clear()
+        for connection in connections:
+            self._stop(connection)
+        await self._stopped(connections)
+        await asyncio.gather(*self.closing, return_exceptions=True)
+
+    def connection_id(self, session_id: str) -> Optional[str]:
+        """Id of the session's current connection in this worker, if any"""
+        connection = self.active_connections.get(session_id)
+        return connection.id if connection is not None else None
+
+    async def send_personal_message(self, message: dict, session_id: str):
+        connection = self.active_connections.get(session_id)
+        if connection is not None:
+            self._enqueue(connection, dumps(message), queue_update=False)
+        elif self.bus is not None:
+            await self.bus.publish("session_message", {"session_id": session_id, "message": message})
+
+    async def send_queue_update(self, encoded: str, session_id: str):
+        """Queue an encoded queue snapshot or delta for one client"""
+        connection = self.active_connections.get(session_id)
+        if connection is not None:
+            self._enqueue(connection, encoded, queue_update=True)
+
+    async def broadcast_queue_update(self, encoded: str, department: str):
+        """Queue an encoded queue delta for every full-view client of a department"""
+        for connection in list(self.active_connections.values()):
+            if connection.view == FULL_VIEW and connection.department == department:
+                self._enqueue(connection, encoded, queue_update=True)
+
+    async def send_personal_view(self, session_id: str, view_for: Callable[[int], Dict], force: bool = False):
+        """Queue a patient's queue_position message if it changed (or always, with force)"""
+        connection = self.active_connections.get(session_id)
+        if connection is not None and connection.view == PERSONAL_VIEW:
+            self._queue_view(connection, view_for, force)
+
+    async def broadcast_personal_views(self, view_for: Callable[[int], Dict], department: str):
+        """Queue changed queue_position messages for personal-view clients that may be in a department"""
+        for connection in list(self.active_connections.values()):
+            if connection.view == PERSONAL_VIEW and connection.department in (department, None):
+                self._queue_view(connection, view_for, force=False)
+
+    def stats(self) -> Dict:
+        return {
+            "connections": len(self.active_connections),
+            "full_views": dict(Counter(
+                connection.department for connection in self.active_connections.values()
+                if connection.view == FULL_VIEW
+            )),
+            "queued": sum(len(connection.pending) for connection in self.active_connections.values()),
+            "policy": self.policy,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "send_failures": self.send_failures,
+        }
+
+    async def _receive_personal_message(self, payload: Dict):
+        connection = self.active_connections.get(payload["session_id"])
+        if connection is not None:
+            self._enqueue(connection, dumps(payload["message"]), queue_update=False)
+
+    def _queue_view(self, connection: Connection, view_for: Callable[[int], Dict], force: bool):
+        if connection.user_id is None:
+            view = {"queue_entry_id": None, "position": None, "department": None}
+        else:
+            view = view_for(connection.user_id)
+        connection.department = view.get("department")
+        if not force and view == connection.last_view:
+            return
+        connection.last_view = view
+        self._enqueue(connection, dumps(dict(view, type="queue_position")), queue_update=True)
+
+    def _enqueue(self, connection: Connection, encoded: str, queue_update: bool):
+        if len(connection.pending) >= self.max_pending and queue_update:
+            if self.policy == "disconnect":
+                self.slow_disconnects += 1
+                print(f"Disconnecting slow WebSocket client {connection.session_id}: "
+                      f"{len(connection.pending)} messages pending")
+                self._close(connection, "Too many pending messages")
+                return
+            if self.policy == "drop" and connection.view == FULL_VIEW:
+                self.dropped += 1
+                return
+            # Coalesce: every queued queue update is superseded by the current state
+            kept = [pending for pending in connection.pending if not pending[0]]
+            self.coalesced += len(connection.pending) - len(kept)
+            connection.pending = deque(kept)
+            if connection.view == FULL_VIEW:
+                encoded = self.snapshot(connection.department)
+        connection.pending.append((queue_update, encoded))
+        connection.ready.set()
+
+    async def _write(self, connection: Connection):
+        try:
+            while not connection.stopped:
+                await connection.ready.wait()
+                while connection.pending and not connection.stopped:
+                    _, encoded = connection.pending.popleft()
+                    await asyncio.wait_for(connection.websocket.send_text(encoded), self.send_timeout)
+                    self.sent += 1
+                connection.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.send_failures += 1
+            print(f"Dropping WebSocket client {connection.session_id}: {type(e).__name__}: {e}")
+            self._close(connection, "Send failed")
+
+    def _close(self, connection: Connection, reason: str):
+        if self._detach(connection.session_id, connection.websocket) is not None:
+            self._finish(connection, reason)
+
+    def _detach(self, session_id: str, websocket: Optional[WebSocket]) -> Optional[Connection]:
+        """Remove a session's connection and cancel its writer, returning the connection"""
+        connection = self.active_connections.get(session_id)
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return None
+        del self.active_connections[session_id]
+        self._stop(connection)
+        return connection
+
+    def _finish(self, connection: Connection, reason: str, code: int = CLOSE_TRY_AGAIN_LATER):
+        """Wait for a stopped connection's writer, then close its socket, in a tracked task"""
+        async def finish():
+            await self._stopped([connection])
+            await self._close_socket(connection.websocket, reason, code)
+
+        task = asyncio.ensure_future(finish())
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    async def _close_socket(self, websocket: WebSocket, reason: str, code: int = CLOSE_TRY_AGAIN_LATER):
+        try:
+            await asyncio.wait_for(websocket.close(code=code, reason=reason), self.send_timeout)
+        except Exception:
+            pass  # Already gone
+
+    @staticmethod
+    def _stop(connection: Connection):
+        # Flag as well as cancel: wait_for swallows a cancel that lands as its send completes
+        connection.stopped = True
+        connection.ready.set()
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    @staticmethod
+    async def _stopped(connections):
+        """Wait for cancelled writers to finish, so none is left pending when the loop closes"""
+        current = asyncio.current_task()
+        await asyncio.gather(*(
+            connection.writer for connection in connections
+            if connection.writer is not None and connection.writer is not current
+        ), return_exceptions=True)
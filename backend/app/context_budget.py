@@ -0,0 +1,56 @@
+"""
+Context budget for LLM prompts.
+
+Once the turns not yet covered by the stored summary grow past the
+character budget, everything except the most recent turns is folded into
+the running summary on ConversationHistory. Each turn is summarized at most
+once, and prompts carry the summary plus the recent turns verbatim. The
+read transaction ends before the summarization call, and the summary is
+written after it.
+"""
+
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+from app.models import ConversationHistory
+from app.conversation_store import ConversationStore
+
+CONTEXT_CHAR_BUDGET = int(os.getenv("CONTEXT_CHAR_BUDGET", "12000"))
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "8"))
+
+Summarizer = Callable[[Optional[str], List[Dict]], Awaitable[Optional[str]]]
+
+
+async def load_context(
+    store: ConversationStore,
+    user_id: int,
+    history: Optional[ConversationHistory],
+    summarize: Summarizer
+) -> List[Dict]:
+    """Messages to send to the LLM: the running summary (if any) followed by unsummarized turns.
+
+    Commits the session before calling summarize, so no transaction stays
+    open during the LLM call. Updates history.summary and
+    history.summary_through afterwards when compacting; the caller commits.
+    """
+    summary = history.summary if history else None
+    summary_through = (history.summary_through or 0) if history else 0
+    messages = await store.get_messages_since(user_id, summary_through)
+
+    if history is not None and _over_budget(messages) and len(messages) > CONTEXT_RECENT_MESSAGES:
+        split = len(messages) - CONTEXT_RECENT_MESSAGES
+        older, recent = messages[:split], messages[split:]
+        await store.db.commit()
+        new_summary = await summarize(summary, older)
+        if new_summary:
+            # Sequences are contiguous, so the folded turns end at this sequence
+            history.summary = new_summary
+            history.summary_through = summary_through + len(older)
+            summary, messages = new_summary, recent
+
+    if summary:
+        return [{"role": "summary", "content": summary}] + messages
+    return messages
+
+
+def _over_budget(messages: List[Dict]) -> bool:
+    return sum(len(msg.get("content") or "") for msg in messages) > CONTEXT_CHAR_BUDGET
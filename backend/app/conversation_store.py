@@ -0,0 +1,71 @@
+from sqlalchemy import func, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Optional
+from app.models import ConversationMessage
+
+
+class ConversationStore:
+    """Append-only per-turn message storage for triage conversations"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def append(self, user_id: int, messages: List[Dict]) -> int:
+        """Append messages after the user's latest turn; returns the last sequence number.
+
+        The caller commits, so the new turns land in the same transaction as
+        any other changes made for the request. Each sequence number is
+        taken inside its INSERT, which holds the write lock, so concurrent
+        appends for one user never pick the same number.
+        """
+        for message in messages:
+            await self.db.execute(insert(ConversationMessage).from_select(
+                ["user_id", "sequence", "role", "content"],
+                select(
+                    literal(user_id),
+                    func.coalesce(func.max(ConversationMessage.sequence), 0) + 1,
+                    literal(message.get("role", "user")),
+                    literal(message.get("content", ""))
+                ).where(ConversationMessage.user_id == user_id)
+            ))
+        return await self.last_sequence(user_id)
+
+    async def get_messages(self, user_id: int, limit: Optional[int] = None) -> List[Dict]:
+        """Get messages from the start of the conversation, optionally only the first few"""
+        query = select(ConversationMessage.role, ConversationMessage.content).where(
+            ConversationMessage.user_id == user_id
+        ).order_by(ConversationMessage.sequence)
+        if limit is not None:
+            query = query.limit(limit)
+        rows = (await self.db.execute(query)).all()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    async def get_messages_since(self, user_id: int, after_sequence: int) -> List[Dict]:
+        """Get messages with a sequence number greater than after_sequence"""
+        rows = (await self.db.execute(
+            select(ConversationMessage.role, ConversationMessage.content).where(
+                ConversationMessage.user_id == user_id,
+                ConversationMessage.sequence > after_sequence
+            ).order_by(ConversationMessage.sequence)
+        )).all()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    async def get_recent_messages(self, user_id: int, count: int) -> List[Dict]:
+        """Get the last count messages in conversation order"""
+        rows = (await self.db.execute(
+            select(ConversationMessage.role, ConversationMessage.content).where(
+                ConversationMessage.user_id == user_id
+            ).order_by(ConversationMessage.sequence.desc()).limit(count)
+        )).all()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    async def count_messages(self, user_id: int) -> int:
+        """Number of stored turns; sequences are contiguous, so this is the last sequence"""
+        return await self.last_sequence(user_id)
+
+    async def last_sequence(self, user_id: int) -> int:
+        return (await self.db.execute(
+            select(ConversationMessage.sequence).where(
+                ConversationMessage.user_id == user_id
+            ).order_by(ConversationMessage.sequence.desc()).limit(1)
+        )).scalar() or 0
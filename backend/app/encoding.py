@@ -0,0 +1,19 @@
+"""
+JSON encoding for payloads sent to many clients. Uses orjson when it is
+installed and falls back to the standard library otherwise.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # Optional speedup
+    orjson = None
+
+
+def dumps(obj: Any) -> str:
+    """Compact JSON text"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
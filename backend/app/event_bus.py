@@ -0,0 +1,207 @@
+"""
+Event bus and leader election between worker processes.
+
+Each uvicorn worker holds its own WebSockets, queue index and scheduler,
+while the database is shared. The bus carries what the other workers need
+to hear about: queue entries that changed, messages for sessions whose
+socket is held by another worker, and check-in registrations. Leader
+election picks the one worker that runs process-wide jobs (check-ins).
+
+EVENT_BUS selects the implementation:
+- "local" (default): a single worker. There is nobody to publish to and
+  this process is always the leader.
+- "sqlite": any number of workers on one host sharing the database file.
+  Events are rows in bus_events that every worker polls, and leadership
+  is a lease row the holder keeps renewing.
+
+publish() reaches the other processes only; the publishing process
+applies its own change directly.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.models import BusEvent, LeaderLease
+
+EVENT_BUS = os.getenv("EVENT_BUS", "local").lower()
+EVENT_BUS_POLL_MS = float(os.getenv("EVENT_BUS_POLL_MS", "20"))  # Added delivery latency, worst case
+EVENT_BUS_RETENTION_SECONDS = float(os.getenv("EVENT_BUS_RETENTION_SECONDS", "60"))
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "10"))  # Failover time after a leader dies
+
+LEADER_ROLE = "scheduler"
+
+Handler = Callable[[Dict], Awaitable[None]]
+LeadershipHandler = Callable[[bool], Awaitable[None]]
+
+
+class EventBus:
+    """Single-process bus: publish has no other workers to reach, and this one leads"""
+
+    def __init__(self):
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.published = 0
+        self.received = 0
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._on_leadership: Optional[LeadershipHandler] = None
+
+    def subscribe(self, topic: str, handler: Handler):
+        """Call handler with the payload of every event on topic from another worker"""
+        self._handlers[topic].append(handler)
+
+    async def publish(self, topic: str, payload: Dict):
+        """Send an event to every other worker"""
+
+    async def start(self, on_leadership: LeadershipHandler):
+        """Start delivering events; on_leadership is awaited whenever this worker gains or loses the lead"""
+        self._on_leadership = on_leadership
+        await self._set_leader(True)
+
+    async def stop(self):
+        self.is_leader = False
+
+    def stats(self) -> Dict:
+        return {
+            "backend": type(self).__name__,
+            "worker_id": self.worker_id,
+            "is_leader": self.is_leader,
+            "published": self.published,
+            "received": self.received,
+        }
+
+    async def _dispatch(self, topic: str, payload: Dict):
+        self.received += 1
+        for handler in self._handlers.get(topic, []):
+            try:
+                await handler(payload)
+            except Exception as e:
+                print(f"Error handling {topic} event: {e}")
+
+    async def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        print(f"Worker {self.worker_id} {'is now' if leader else 'is no longer'} the {LEADER_ROLE} leader")
+        if self._on_leadership is not None:
+            try:
+                await self._on_leadership(leader)
+            except Exception as e:
+                print(f"Error changing leadership: {e}")
+
+
+class SQLiteEventBus(EventBus):
+    """Bus for workers sharing one SQLite file: events are polled rows, leadership a renewed lease.
+
+    Ids in bus_events only grow, so each worker reads the rows after the
+    last id it has seen. The leader prunes rows older than the retention
+    period. A leader that stops renewing (crashed, or its event loop
+    stalled for longer than the lease) is replaced once the lease expires.
+    """
+
+    def __init__(self, engine: AsyncEngine, poll_seconds: float = EVENT_BUS_POLL_MS / 1000,
+                 retention_seconds: float = EVENT_BUS_RETENTION_SECONDS,
+                 lease_seconds: float = LEADER_LEASE_SECONDS):
+        super().__init__()
+        self.engine = engine
+        self.poll_seconds = poll_seconds
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self._last_id = 0
+        self._lease_expires_at = 0.0  # Monotonic time our lease runs out, if we hold it
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, topic: str, payload: Dict):
+        async with self.engine.begin() as connection:
+            await connection.execute(insert(BusEvent).values(
+                topic=topic, payload=payload, origin=self.worker_id, created_at=datetime.utcnow()
+            ))
+        self.published += 1
+
+    async def start(self, on_leadership: LeadershipHandler):
+        self._on_leadership = on_leadership
+        async with self.engine.begin() as connection:
+            self._last_id = (await connection.execute(select(func.max(BusEvent.id)))).scalar() or 0
+            await connection.execute(sqlite_insert(LeaderLease).values(
+                name=LEADER_ROLE, holder=None, expires_at=datetime.utcnow()
+            ).on_conflict_do_nothing())
+        await self._renew_lease()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            # Hand over now instead of making the next leader wait out the lease
+            async with self.engine.begin() as connection:
+                await connection.execute(update(LeaderLease).where(
+                    LeaderLease.name == LEADER_ROLE, LeaderLease.holder == self.worker_id
+                ).values(holder=None, expires_at=datetime.utcnow()))
+        self.is_leader = False
+
+    async def _run(self):
+        renew_at = time.monotonic() + self.lease_seconds / 3
+        while True:
+            try:
+                await self._poll()
+                if time.monotonic() >= renew_at:
+                    renew_at = time.monotonic() + self.lease_seconds / 3
+                    await self._renew_lease()
+                    if self.is_leader:
+                        await self._prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event bus error: {e}")
+                if self.is_leader and time.monotonic() >= self._lease_expires_at:
+                    await self._set_leader(False)
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _poll(self):
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(
+                select(BusEvent.id, BusEvent.topic, BusEvent.payload, BusEvent.origin).where(
+                    BusEvent.id > self._last_id
+                ).order_by(BusEvent.id)
+            )).all()
+        for event_id, topic, payload, origin in rows:
+            self._last_id = event_id
+            if origin != self.worker_id:
+                await self._dispatch(topic, payload)
+
+    async def _renew_lease(self):
+        """Take or extend the lease if it is ours or has expired"""
+        now = datetime.utcnow()
+        renewed_at = time.monotonic()
+        async with self.engine.begin() as connection:
+            result = await connection.execute(update(LeaderLease).where(
+                LeaderLease.name == LEADER_ROLE,
+                or_(LeaderLease.holder == self.worker_id, LeaderLease.expires_at < now)
+            ).values(holder=self.worker_id, expires_at=now + timedelta(seconds=self.lease_seconds)))
+        leader = result.rowcount == 1
+        if leader:
+            self._lease_expires_at = renewed_at + self.lease_seconds
+        await self._set_leader(leader)
+
+    async def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+        async with self.engine.begin() as connection:
+            await connection.execute(delete(BusEvent).where(BusEvent.created_at < cutoff))
+
+
+def create_event_bus(name: Optional[str] = None) -> EventBus:
+    """Build the bus named by EVENT_BUS"""
+    name = (name or EVENT_BUS).lower()
+    if name == "local":
+        return EventBus()
+    if name == "sqlite":
+        from app.models import async_engine
+        return SQLiteEventBus(async_engine)
+    raise ValueError(f"Unknown EVENT_BUS '{name}'. Use 'local' or 'sqlite'.")
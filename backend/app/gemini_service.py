@@ -1,94 +1,44 @@
 import os
 import json
-import google.generativeai as genai
+import asyncio
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from app.cache import LRUCache
+from app.llm_backends import LLMBackend, create_backend
+from typing import AsyncIterator, List, Dict, Optional
 
 load_dotenv()
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError(
-        "GEMINI_API_KEY environment variable is required. "
-        "Please create a .env file in the backend directory with: GEMINI_API_KEY=your_key_here"
-    )
-genai.configure(api_key=api_key)
-
-
-def get_available_model():
-    """Get an available Gemini model, trying multiple options"""
-    # List of models to try in order of preference (newer models first)
-    model_names = [
-        'gemini-2.5-flash',  # Fastest and most cost-effective
-        'gemini-2.5-pro',   # More capable for complex tasks
-        'gemini-2.0-flash',  # Fallback option
-        'gemini-2.0-flash-exp',  # Experimental fallback
-        'gemini-1.5-flash',  # Older versions as last resort
-        'gemini-1.5-pro',
-        'gemini-pro',
-    ]
-    
-    # Try to list available models first
-    try:
-        available_models = [m.name for m in genai.list_models()]
-        print(f"Available models: {available_models}")
-        
-        # Extract model names (they might be in format 'models/gemini-2.5-flash')
-        model_base_names = [m.split('/')[-1] if '/' in m else m for m in available_models]
-        
-        # Check if any of our preferred models are available
-        for preferred_model in model_names:
-            if preferred_model in model_base_names:
-                print(f"Found available model: {preferred_model}")
-                return preferred_model
-        
-        # If none of our preferred models found, use the first available gemini model
-        gemini_models = [m for m in model_base_names if 'gemini' in m.lower() and 'embedding' not in m.lower()]
-        if gemini_models:
-            selected = gemini_models[0]
-            print(f"Using first available Gemini model: {selected}")
-            return selected
-    except Exception as e:
-        print(f"Could not list models: {e}, will try direct initialization")
-    
-    # If listing failed, try direct initialization with newest model
-    return 'gemini-2.5-flash'
+# Upper bound on LLM calls in flight from the async API
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+# Bounds for cached per-patient chat sessions
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "500"))
+CHAT_SESSION_IDLE_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "1800"))
+
+FALLBACK_TRIAGE = {
+    "severity_score": 5.0,
+    "severity_reasoning": "Unable to analyze - defaulting to moderate severity",
+    "home_guidance": "Please monitor your symptoms and seek medical attention if they worsen.",
+    "emergency_flag": False,
+    "emergency_reason": "",
+    "symptoms_summary": "Analysis unavailable"
+}
+
+
+class _CachedChat:
+    """An LLM chat session plus the stored turn count it reflects"""
+
+    def __init__(self, chat, turns: int, misuse_count: int, head: int):
+        self.chat = chat
+        self.turns = turns
+        self.misuse_count = misuse_count
+        self.head = head  # Hash of the first turn, which changes when the summary does
 
 
 class GeminiService:
-    def __init__(self):
-        # Get an available model
-        model_name = get_available_model()
-        try:
-            self.model = genai.GenerativeModel(model_name)
-            self.model_name = model_name  # Store model name for reference
-            print(f"Successfully initialized Gemini model: {model_name}")
-        except Exception as e:
-            # If initialization fails, try to list available models and show helpful error
-            try:
-                available_models = [m.name for m in genai.list_models()]
-                available_model_names = [m.split('/')[-1] if '/' in m else m for m in available_models]
-                error_msg = (
-                    f"Failed to initialize model '{model_name}'. "
-                    f"Available models: {', '.join(available_model_names)}. "
-                    f"Error: {str(e)}"
-                )
-                print(error_msg)
-                # Try newer models as fallback
-                fallback_models = ['gemini-2.5-flash', 'gemini-2.5-pro', 'gemini-2.0-flash', 'gemini-1.5-flash']
-                for fallback_model in fallback_models:
-                    if fallback_model in available_model_names:
-                        print(f"Trying fallback model: {fallback_model}")
-                        self.model = genai.GenerativeModel(fallback_model)
-                        self.model_name = fallback_model  # Store model name
-                        return
-                raise ValueError(error_msg)
-            except Exception as list_error:
-                raise ValueError(
-                    f"Failed to initialize Gemini model '{model_name}'. "
-                    f"Could not list available models. Error: {str(e)}. "
-                    f"List error: {str(list_error)}"
-                )
+    def __init__(self, backend: Optional[LLMBackend] = None):
+        self._semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        # Live chat sessions keyed by session_id; rebuilt from stored turns on a miss
+        self.chat_sessions = LRUCache(CHAT_SESSION_MAX, CHAT_SESSION_IDLE_SECONDS, sliding=True)
         self.system_prompt = """You are a professional medical triage assistant for a hospital system called MediQueue. 
 Your role is to:
 1. Have a compassionate, professional conversation with patients about their symptoms
@@ -105,31 +55,122 @@ Guidelines:
 - Always prioritize patient safety
 
 After each conversation turn, you should respond naturally to the patient, but also be ready to provide a structured assessment when asked."""
+        self.backend = backend or create_backend()
+        self.model_name = self.backend.model_name  # Store model name for reference
 
     def get_conversation_response(self, messages: List[Dict], user_history: Optional[Dict] = None) -> str:
         """Get AI response for conversation"""
-        conversation_text = self._format_conversation(messages, user_history)
-        
+        prompt = self._conversation_prompt(messages, user_history)
+        try:
+            return self.backend.generate(prompt)
+        except Exception as e:
+            return self._conversation_error(e)
+
+    async def chat_response_async(self, session_id: str, messages: List[Dict], user_history: Optional[Dict] = None) -> str:
+        """Get AI response through the session's cached chat, sending only the newest turn
+
+        messages is the stored conversation plus the new user message at the end.
+        """
+        cached = self._chat_for(session_id, messages, user_history)
+        try:
+            async with self._semaphore:
+                response = await cached.chat.send_async(messages[-1].get("content", ""))
+            cached.turns += 2
+            return response
+        except Exception as e:
+            # The chat may be out of step with what gets stored; rebuild next turn
+            self.chat_sessions.pop(session_id)
+            return await asyncio.to_thread(self._conversation_error, e)
+
+    async def stream_chat_response(self, session_id: str, messages: List[Dict], user_history: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Streaming variant of chat_response_async"""
+        cached = self._chat_for(session_id, messages, user_history)
+        try:
+            async with self._semaphore:
+                async for chunk in cached.chat.stream_async(messages[-1].get("content", "")):
+                    yield chunk
+            cached.turns += 2
+        except Exception as e:
+            self.chat_sessions.pop(session_id)
+            yield await asyncio.to_thread(self._conversation_error, e)
+
+    def end_chat(self, session_id: str):
+        """Drop a cached chat session"""
+        self.chat_sessions.pop(session_id)
+
+    def _chat_for(self, session_id: str, messages: List[Dict], user_history: Optional[Dict]) -> _CachedChat:
+        misuse_count = (user_history or {}).get("misuse_count", 0)
+        head = hash((messages[0].get("role"), messages[0].get("content")))
+        cached = self.chat_sessions.get(session_id)
+        if (cached and cached.turns == len(messages) - 1 and cached.misuse_count == misuse_count
+                and cached.head == head):
+            return cached
+
+        # Missing, evicted, or another request changed the transcript: rebuild from storage
+        instruction = self.system_prompt
+        note = self._misuse_note(user_history)
+        if note:
+            instruction = f"{instruction}\n\n{note}"
+        history = [
+            {
+                "role": "assistant" if msg.get("role") == "assistant" else "user",
+                "content": self._format_message(msg) if msg.get("role") == "summary" else msg.get("content", "")
+            }
+            for msg in messages[:-1]
+        ]
+        cached = _CachedChat(self.backend.start_chat(instruction, history), len(messages) - 1, misuse_count, head)
+        self.chat_sessions.put(session_id, cached)
+        return cached
+
+    async def summarize_conversation_async(self, previous_summary: Optional[str], messages: List[Dict]) -> Optional[str]:
+        """Fold older turns into the running summary; None if the call fails"""
+        prompt = f"""{self.system_prompt}
+
+Update the running summary of this triage conversation. Keep every symptom, onset, duration, severity detail, medication, allergy and warning sign the patient mentioned. Write plain prose in under 200 words.
+
+Current summary:
+{previous_summary or "(none)"}
+
+New turns to fold in:
+{self._format_conversation(messages)}
+
+Updated summary:"""
         try:
-            prompt = f"{self.system_prompt}\n\nConversation so far:\n{conversation_text}\n\nRespond naturally to the patient:"
-            response = self.model.generate_content(prompt)
-            return response.text
+            async with self._semaphore:
+                response = await self.backend.generate_async(prompt)
+            return response.strip() or None
         except Exception as e:
-            error_str = str(e)
-            # Provide more helpful error message
-            if "404" in error_str or "not found" in error_str.lower():
-                try:
-                    available_models = [m.name.split('/')[-1] if '/' in m.name else m.name for m in genai.list_models()]
-                    error_str += f" Available models: {', '.join(available_models[:5])}"
-                except:
-                    pass
-            return f"I apologize, I'm having trouble processing that. Could you please repeat? Error: {error_str}"
+            print(f"Could not summarize conversation: {e}")
+            return None
 
     def analyze_triage(self, messages: List[Dict], user_history: Optional[Dict] = None) -> Dict:
         """Analyze conversation and extract triage information"""
+        try:
+            response = self.backend.generate(self._analysis_prompt(messages, user_history))
+            return self._parse_triage(response)
+        except Exception:
+            return self._fallback_triage()
+
+    async def analyze_triage_async(self, messages: List[Dict], user_history: Optional[Dict] = None) -> Dict:
+        """Async variant of analyze_triage that does not block the event loop"""
+        try:
+            async with self._semaphore:
+                response = await self.backend.generate_async(self._analysis_prompt(messages, user_history))
+            return self._parse_triage(response)
+        except Exception:
+            return self._fallback_triage()
+
+    def _conversation_prompt(self, messages: List[Dict], user_history: Optional[Dict] = None) -> str:
         conversation_text = self._format_conversation(messages, user_history)
-        
-        analysis_prompt = f"""{self.system_prompt}
+        return f"{self.system_prompt}\n\nConversation so far:\n{conversation_text}\n\nRespond naturally to the patient:"
+
+    def _conversation_error(self, error: Exception) -> str:
+        error_str = self.backend.describe_error(error)
+        return f"I apologize, I'm having trouble processing that. Could you please repeat? Error: {error_str}"
+
+    def _analysis_prompt(self, messages: List[Dict], user_history: Optional[Dict] = None) -> str:
+        conversation_text = self._format_conversation(messages, user_history)
+        return f"""{self.system_prompt}
 
 Based on this conversation, provide a structured assessment in JSON format:
 {{
@@ -146,32 +187,25 @@ Conversation:
 
 Provide ONLY the JSON response, no additional text:"""
 
-        try:
-            response = self.model.generate_content(analysis_prompt)
-            response_text = response.text.strip()
-            
-            # Extract JSON from response (handle markdown code blocks)
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            triage_data = json.loads(response_text)
-            
-            # Ensure severity_score is between 1-10
-            triage_data["severity_score"] = max(1, min(10, float(triage_data.get("severity_score", 5))))
-            
-            return triage_data
-        except Exception as e:
-            # Fallback if JSON parsing fails
-            return {
-                "severity_score": 5.0,
-                "severity_reasoning": "Unable to analyze - defaulting to moderate severity",
-                "home_guidance": "Please monitor your symptoms and seek medical attention if they worsen.",
-                "emergency_flag": False,
-                "emergency_reason": "",
-                "symptoms_summary": "Analysis unavailable"
-            }
+    def _parse_triage(self, response_text: str) -> Dict:
+        response_text = response_text.strip()
+
+        # Extract JSON from response (handle markdown code blocks)
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0].strip()
+
+        triage_data = json.loads(response_text)
+
+        # Ensure severity_score is between 1-10
+        triage_data["severity_score"] = max(1, min(10, float(triage_data.get("severity_score", 5))))
+
+        return triage_data
+
+    def _fallback_triage(self) -> Dict:
+        # Fallback if the call or JSON parsing fails
+        return dict(FALLBACK_TRIAGE)
 
     def check_misuse(self, current_severity: float, user_history: Optional[Dict]) -> Dict:
         """Check for potential misuse based on user history"""
@@ -199,13 +233,23 @@ Provide ONLY the JSON response, no additional text:"""
         """Format conversation messages into text"""
         formatted = []
         
-        if user_history and user_history.get("misuse_count", 0) > 0:
-            formatted.append(f"[Note: This user has {user_history['misuse_count']} previous misuse flags. Please verify their responses carefully.]")
+        note = self._misuse_note(user_history)
+        if note:
+            formatted.append(note)
         
         for msg in messages:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-            formatted.append(f"{role.capitalize()}: {content}")
+            formatted.append(self._format_message(msg))
         
         return "\n".join(formatted)
 
+    def _format_message(self, msg: Dict) -> str:
+        role = msg.get("role", "user")
+        content = msg.get("content", "")
+        if role == "summary":
+            return f"Summary of the earlier conversation: {content}"
+        return f"{role.capitalize()}: {content}"
+
+    def _misuse_note(self, user_history: Optional[Dict]) -> Optional[str]:
+        if user_history and user_history.get("misuse_count", 0) > 0:
+            return f"[Note: This user has {user_history['misuse_count']} previous misuse flags. Please verify their responses carefully.]"
+        return None
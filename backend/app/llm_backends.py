@@ -0,0 +1,313 @@
+"""
+LLM backends used by GeminiService.
+
+LLM_BACKEND selects the implementation:
+- "gemini" (default): Google Gemini through google-generativeai
+- "stub": deterministic local stand-in with configurable latency, for load
+  testing and profiling without network access
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.triage_logic import EMERGENCY_KEYWORDS
+
+load_dotenv()
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+
+# Stub backend tuning
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "800"))  # Median full-response latency
+LLM_STUB_LATENCY_SIGMA = float(os.getenv("LLM_STUB_LATENCY_SIGMA", "0.4"))  # Log-normal spread, 0 = fixed
+LLM_STUB_FIRST_CHUNK_FRACTION = float(os.getenv("LLM_STUB_FIRST_CHUNK_FRACTION", "0.3"))
+LLM_STUB_CHUNK_CHARS = int(os.getenv("LLM_STUB_CHUNK_CHARS", "24"))
+LLM_STUB_SEVERITY = os.getenv("LLM_STUB_SEVERITY")  # Fixed severity instead of a derived one
+LLM_STUB_SEED = os.getenv("LLM_STUB_SEED", "0")
+
+
+class LLMChat(ABC):
+    """A multi-turn conversation that keeps its own history"""
+
+    @abstractmethod
+    async def send_async(self, text: str) -> str:
+        ...
+
+    @abstractmethod
+    def stream_async(self, text: str) -> AsyncIterator[str]:
+        ...
+
+
+class LLMBackend(ABC):
+    """Text generation interface GeminiService is written against"""
+
+    model_name: str
+
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        ...
+
+    @abstractmethod
+    async def generate_async(self, prompt: str) -> str:
+        ...
+
+    @abstractmethod
+    def stream_async(self, prompt: str) -> AsyncIterator[str]:
+        ...
+
+    @abstractmethod
+    def start_chat(self, system_instruction: str, history: List[Dict]) -> LLMChat:
+        """history holds {"role": "user" | "assistant", "content": str} turns"""
+
+    def describe_error(self, error: Exception) -> str:
+        return str(error)
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    """Build the backend named by LLM_BACKEND"""
+    name = (name or LLM_BACKEND).lower()
+    if name == "gemini":
+        return GeminiBackend()
+    if name == "stub":
+        return StubBackend()
+    raise ValueError(f"Unknown LLM_BACKEND '{name}'. Use 'gemini' or 'stub'.")
+
+
+async def _text_chunks(response) -> AsyncIterator[str]:
+    async for chunk in response:
+        # Chunks without text parts (e.g. safety metadata) raise on .text
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
+
+
+class _GeminiChat(LLMChat):
+    def __init__(self, chat):
+        self._chat = chat
+
+    async def send_async(self, text: str) -> str:
+        response = await self._chat.send_message_async(text)
+        return response.text
+
+    async def stream_async(self, text: str) -> AsyncIterator[str]:
+        response = await self._chat.send_message_async(text, stream=True)
+        async for chunk in _text_chunks(response):
+            yield chunk
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self):
+        import google.generativeai as genai
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError(
+                "GEMINI_API_KEY environment variable is required. "
+                "Please create a .env file in the backend directory with: GEMINI_API_KEY=your_key_here "
+                "(or set LLM_BACKEND=stub to run without Gemini)"
+            )
+        genai.configure(api_key=api_key)
+        self.genai = genai
+
+        # Get an available model
+        model_name = self._get_available_model()
+        try:
+            self.model = genai.GenerativeModel(model_name)
+            self.model_name = model_name  # Store model name for reference
+            print(f"Successfully initialized Gemini model: {model_name}")
+        except Exception as e:
+            # If initialization fails, try to list available models and show helpful error
+            try:
+                available_model_names = self._list_model_names()
+                error_msg = (
+                    f"Failed to initialize model '{model_name}'. "
+                    f"Available models: {', '.join(available_model_names)}. "
+                    f"Error: {str(e)}"
+                )
+                print(error_msg)
+                # Try newer models as fallback
+                fallback_models = ['gemini-2.5-flash', 'gemini-2.5-pro', 'gemini-2.0-flash', 'gemini-1.5-flash']
+                for fallback_model in fallback_models:
+                    if fallback_model in available_model_names:
+                        print(f"Trying fallback model: {fallback_model}")
+                        self.model = genai.GenerativeModel(fallback_model)
+                        self.model_name = fallback_model  # Store model name
+                        return
+                raise ValueError(error_msg)
+            except Exception as list_error:
+                raise ValueError(
+                    f"Failed to initialize Gemini model '{model_name}'. "
+                    f"Could not list available models. Error: {str(e)}. "
+                    f"List error: {str(list_error)}"
+                )
+
+    def generate(self, prompt: str) -> str:
+        return self.model.generate_content(prompt).text
+
+    async def generate_async(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+    async def stream_async(self, prompt: str) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in _text_chunks(response):
+            yield chunk
+
+    def start_chat(self, system_instruction: str, history: List[Dict]) -> LLMChat:
+        model = self.genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+        return _GeminiChat(model.start_chat(history=[
+            {"role": "model" if turn["role"] == "assistant" else "user", "parts": [turn["content"]]}
+            for turn in history
+        ]))
+
+    def describe_error(self, error: Exception) -> str:
+        error_str = str(error)
+        # Provide more helpful error message
+        if "404" in error_str or "not found" in error_str.lower():
+            try:
+                error_str += f" Available models: {', '.join(self._list_model_names()[:5])}"
+            except:
+                pass
+        return error_str
+
+    def _list_model_names(self) -> List[str]:
+        # Model names might be in format 'models/gemini-2.5-flash'
+        return [m.name.split('/')[-1] if '/' in m.name else m.name for m in self.genai.list_models()]
+
+    def _get_available_model(self) -> str:
+        """Get an available Gemini model, trying multiple options"""
+        # List of models to try in order of preference (newer models first)
+        model_names = [
+            'gemini-2.5-flash',  # Fastest and most cost-effective
+            'gemini-2.5-pro',   # More capable for complex tasks
+            'gemini-2.0-flash',  # Fallback option
+            'gemini-2.0-flash-exp',  # Experimental fallback
+            'gemini-1.5-flash',  # Older versions as last resort
+            'gemini-1.5-pro',
+            'gemini-pro',
+        ]
+
+        # Try to list available models first
+        try:
+            model_base_names = self._list_model_names()
+            print(f"Available models: {model_base_names}")
+
+            # Check if any of our preferred models are available
+            for preferred_model in model_names:
+                if preferred_model in model_base_names:
+                    print(f"Found available model: {preferred_model}")
+                    return preferred_model
+
+            # If none of our preferred models found, use the first available gemini model
+            gemini_models = [m for m in model_base_names if 'gemini' in m.lower() and 'embedding' not in m.lower()]
+            if gemini_models:
+                selected = gemini_models[0]
+                print(f"Using first available Gemini model: {selected}")
+                return selected
+        except Exception as e:
+            print(f"Could not list models: {e}, will try direct initialization")
+
+        # If listing failed, try direct initialization with newest model
+        return 'gemini-2.5-flash'
+
+
+STUB_REPLIES = [
+    "I'm sorry you're dealing with this. How long have you had these symptoms, and have they been getting better or worse?",
+    "Thank you for explaining. On a scale of 1 to 10, how would you rate your discomfort right now?",
+    "That's helpful to know. Are you taking any medications, and do you have any allergies we should be aware of?",
+    "I understand. While you wait, rest, stay hydrated and let us know right away if anything gets worse.",
+]
+
+
+class _StubChat(LLMChat):
+    def __init__(self, backend: "StubBackend", system_instruction: str, history: List[Dict]):
+        self._backend = backend
+        self._transcript = [system_instruction] + [turn["content"] for turn in history]
+
+    async def send_async(self, text: str) -> str:
+        self._transcript.append(text)
+        reply = await self._backend.generate_async("\n".join(self._transcript))
+        self._transcript.append(reply)
+        return reply
+
+    async def stream_async(self, text: str) -> AsyncIterator[str]:
+        self._transcript.append(text)
+        chunks = []
+        async for chunk in self._backend.stream_async("\n".join(self._transcript)):
+            chunks.append(chunk)
+            yield chunk
+        self._transcript.append("".join(chunks))
+
+
+class StubBackend(LLMBackend):
+    """Offline stand-in: output and latency are a pure function of the prompt and LLM_STUB_SEED"""
+
+    def __init__(self):
+        self.model_name = "stub"
+        self.calls = 0
+        print(
+            f"Using stub LLM backend (median latency {LLM_STUB_LATENCY_MS:.0f} ms, "
+            f"sigma {LLM_STUB_LATENCY_SIGMA})"
+        )
+
+    def generate(self, prompt: str) -> str:
+        text, latency = self._respond(prompt)
+        time.sleep(latency)
+        return text
+
+    async def generate_async(self, prompt: str) -> str:
+        text, latency = self._respond(prompt)
+        await asyncio.sleep(latency)
+        return text
+
+    async def stream_async(self, prompt: str) -> AsyncIterator[str]:
+        text, latency = self._respond(prompt)
+        chunks = [text[i:i + LLM_STUB_CHUNK_CHARS] for i in range(0, len(text), LLM_STUB_CHUNK_CHARS)] or [""]
+        first = latency * LLM_STUB_FIRST_CHUNK_FRACTION
+        step = (latency - first) / max(len(chunks) - 1, 1)
+        for i, chunk in enumerate(chunks):
+            await asyncio.sleep(first if i == 0 else step)
+            yield chunk
+
+    def start_chat(self, system_instruction: str, history: List[Dict]) -> LLMChat:
+        return _StubChat(self, system_instruction, history)
+
+    def _respond(self, prompt: str):
+        self.calls += 1
+        digest = hashlib.sha256(f"{LLM_STUB_SEED}:{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        latency = LLM_STUB_LATENCY_MS / 1000
+        if LLM_STUB_LATENCY_SIGMA > 0:
+            latency *= math.exp(rng.gauss(0, LLM_STUB_LATENCY_SIGMA))
+
+        if '"severity_score"' in prompt:
+            return self._triage_json(prompt, rng), latency
+        if prompt.rstrip().endswith("Updated summary:"):
+            return "Patient reported symptoms over several turns; see recent messages for details.", latency
+        return rng.choice(STUB_REPLIES), latency
+
+    def _triage_json(self, prompt: str, rng: random.Random) -> str:
+        conversation = prompt.rsplit("Conversation:", 1)[-1].lower()
+        emergency = any(keyword in conversation for keyword in EMERGENCY_KEYWORDS)
+        if LLM_STUB_SEVERITY:
+            severity = float(LLM_STUB_SEVERITY)
+        else:
+            severity = 9 if emergency else rng.randint(2, 8)
+        return json.dumps({
+            "severity_score": severity,
+            "severity_reasoning": "Stub assessment",
+            "home_guidance": "Rest, stay hydrated and monitor your symptoms.",
+            "emergency_flag": emergency,
+            "emergency_reason": "Emergency keywords reported" if emergency else "",
+            "symptoms_summary": "Symptoms reported during stub conversation",
+        })
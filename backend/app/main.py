@@ -1,17 +1,32 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import uuid
 import json
+from functools import partial
 from datetime import datetime
 
-from app.models import Base, engine, SessionLocal, User, QueueEntry, ConversationHistory, CheckInLog, init_db
-from app.gemini_service import GeminiService
-from app.queue_manager import QueueManager
-from app.triage_logic import is_emergency, get_care_recommendation
-from app.scheduler import register_check_in_callback, unregister_check_in_callback, start_scheduler
+from app.models import async_engine, AsyncSessionLocal, User, QueueEntry, ConversationHistory, CheckInLog, init_db
+from app.gemini_service import GeminiService, FALLBACK_TRIAGE
+from app.triage_cache import TriageCache, TRIAGE_CACHE_PERSIST
+from app.conversation_store import ConversationStore
+from app.context_budget import load_context
+from app.single_flight import SingleFlight
+from app.queue_manager import QueueManager, department_of, wait_estimate_stats
+from app.queue_feed import QueueFeed, QUEUE_BROADCAST_WINDOW_MS, QUEUE_BROADCAST_MAX_STALENESS_MS
+from app.coalescer import Coalescer
+from app.connections import ConnectionManager, is_staff, FULL_VIEW, PERSONAL_VIEW
+from app.event_bus import create_event_bus
+from app.triage_logic import (
+    is_emergency, get_care_recommendation, get_department, DEPARTMENTS, DEFAULT_DEPARTMENT, SEVERITY_LEVELS
+)
+from app.scheduler import (
+    register_check_in_callback, unregister_check_in_callback, start_scheduler, schedule_queue_reorder,
+    schedule_check_in, cancel_check_in, lead_check_ins
+)
 
 # Initialize database
 init_db()
@@ -29,50 +44,160 @@ app.add_middleware(
 
 # Initialize services
 gemini_service = GeminiService()
+triage_cache = TriageCache()
+# Duplicate concurrent /api/message and /api/complete-triage calls share one run
+session_requests = SingleFlight()
+# Sequenced queue deltas sent over /ws/{session_id}, one feed per department
+queue_feeds = {department: QueueFeed(department) for department in DEPARTMENTS}
+# Reaches the other uvicorn workers, if any, and elects the one running check-ins
+bus = create_event_bus()
+# WebSocket connections, each with its own bounded send queue
+manager = ConnectionManager(lambda department: queue_feeds[department].snapshot(), bus)
+
+
+async def broadcast_queue(department: str):
+    """Broadcast a department's queue changes and schedule a rebroadcast for its next aging reorder"""
+    async with AsyncSessionLocal() as db:
+        queue_manager = QueueManager(db)
+        delta = queue_feeds[department].publish(
+            queue_manager.get_queue_state(department), queue_manager.version(department),
+            queue_manager.wait_estimate(department)
+        )
+        if delta is not None:
+            await manager.broadcast_queue_update(delta, department)
+            await manager.broadcast_personal_views(queue_manager.get_personal_view, department)
+        schedule_queue_reorder(department, queue_manager.next_reorder_at(department), broadcast_reordered_queue)
+
+
+# Bursts of queue mutations are merged into one recompute and broadcast per department
+queue_broadcasts = {
+    department: Coalescer(
+        partial(broadcast_queue, department),
+        QUEUE_BROADCAST_WINDOW_MS / 1000,
+        QUEUE_BROADCAST_MAX_STALENESS_MS / 1000
+    )
+    for department in DEPARTMENTS
+}
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
 
-    async def connect(self, websocket: WebSocket, session_id: str):
-        await websocket.accept()
-        self.active_connections[session_id] = websocket
+async def broadcast_reordered_queue(department: str):
+    """Scheduler job fired when waiting times change a department's queue order"""
+    queue_broadcasts[department].request()
 
-    def disconnect(self, session_id: str):
-        if session_id in self.active_connections:
-            del self.active_connections[session_id]
 
-    async def send_personal_message(self, message: dict, session_id: str):
-        if session_id in self.active_connections:
-            await self.active_connections[session_id].send_json(message)
+async def queue_changed(department: str, *entry_ids: int):
+    """Broadcast a queue mutation made here, and have other workers reload the changed entries"""
+    queue_broadcasts[department].request()
+    await bus.publish("queue_changed", {"entry_ids": list(entry_ids)})
+
+
+async def on_queue_changed(payload: Dict):
+    async with AsyncSessionLocal() as db:
+        departments = await QueueManager(db).reload_entries(payload["entry_ids"])
+    for department in departments:
+        queue_broadcasts[department].request()
+
+
+def resolve_department(department: Optional[str]) -> str:
+    """Validate a requested department, defaulting when none is given"""
+    department = department or DEFAULT_DEPARTMENT
+    if department not in queue_feeds:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown department '{department}'. Use one of: {', '.join(DEPARTMENTS)}"
+        )
+    return department
+
+
+def check_in_callback_for(session_id: str):
+    async def check_in_callback(message: dict):
+        await manager.send_personal_message(message, session_id)
+    return check_in_callback
+
+
+async def register_check_ins(session_id: str, owner: Optional[str] = None):
+    """Register a patient for check-ins in every worker, since any of them may be the leader.
+
+    owner is the connection the registration belongs to; only that
+    connection going away unregisters it again.
+    """
+    register_check_in_callback(session_id, check_in_callback_for(session_id), owner)
+    await bus.publish("check_in_registered", {"session_id": session_id, "owner": owner})
+
+
+async def unregister_check_ins(session_id: str, owner: str):
+    unregister_check_in_callback(session_id, owner)
+    await bus.publish("check_in_unregistered", {"session_id": session_id, "owner": owner})
 
-    async def broadcast_queue_update(self, queue_state: List[Dict]):
-        """Broadcast queue updates to all connected clients"""
-        message = {
-            "type": "queue_update",
-            "queue": queue_state
-        }
-        disconnected = []
-        for session_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_json(message)
-            except:
-                disconnected.append(session_id)
-        
-        for session_id in disconnected:
-            self.disconnect(session_id)
 
-manager = ConnectionManager()
+async def schedule_next_check_in(entry_id: int, last_check_in: datetime):
+    """Schedule the entry's next check-in on whichever worker leads"""
+    schedule_check_in(entry_id, last_check_in)
+    await bus.publish("check_in_scheduled", {"entry_id": entry_id, "last_check_in": last_check_in.isoformat()})
+
+
+async def on_check_in_registered(payload: Dict):
+    register_check_in_callback(
+        payload["session_id"], check_in_callback_for(payload["session_id"]), payload.get("owner")
+    )
+
+
+async def on_check_in_unregistered(payload: Dict):
+    unregister_check_in_callback(payload["session_id"], payload.get("owner"))
+
+
+async def on_check_in_scheduled(payload: Dict):
+    schedule_check_in(payload["entry_id"], datetime.fromisoformat(payload["last_check_in"]))
+
+
+bus.subscribe("queue_changed", on_queue_changed)
+bus.subscribe("check_in_registered", on_check_in_registered)
+bus.subscribe("check_in_unregistered", on_check_in_unregistered)
+bus.subscribe("check_in_scheduled", on_check_in_scheduled)
+
+
+async def stream_assistant_reply(session_id: str, messages: List[Dict], user_history: Dict) -> str:
+    """Push reply chunks to the patient's WebSocket as they are generated and return the full text"""
+    chunks = []
+    deliver = True
+    async for chunk in gemini_service.stream_chat_response(session_id, messages, user_history):
+        chunks.append(chunk)
+        if not deliver:
+            continue
+        try:
+            await manager.send_personal_message(
+                {"type": "message_chunk", "index": len(chunks) - 1, "content": chunk},
+                session_id
+            )
+        except Exception as e:
+            # Keep generating so the reply is still saved and returned over HTTP
+            print(f"Stopped streaming to {session_id}: {e}")
+            deliver = False
+
+    response = "".join(chunks)
+    if deliver:
+        try:
+            await manager.send_personal_message({"type": "message_complete", "content": response}, session_id)
+        except Exception as e:
+            print(f"Stopped streaming to {session_id}: {e}")
+    return response
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def get_user(db: AsyncSession, session_id: str) -> Optional[User]:
+    return (await db.execute(select(User).where(User.session_id == session_id))).scalars().first()
+
+
+async def get_latest_history(db: AsyncSession, user_id: int) -> Optional[ConversationHistory]:
+    return (await db.execute(
+        select(ConversationHistory).where(
+            ConversationHistory.user_id == user_id
+        ).order_by(ConversationHistory.timestamp.desc()).limit(1)
+    )).scalars().first()
 
 
 # Pydantic models
@@ -84,10 +209,13 @@ class StartTriageRequest(BaseModel):
 class MessageRequest(BaseModel):
     session_id: str
     content: str
+    stream: bool = False  # Push partial replies to /ws/{session_id} while generating
+    request_id: Optional[str] = None  # Idempotency key; retries with the same key replay the result
 
 
 class CompleteTriageRequest(BaseModel):
     session_id: str
+    request_id: Optional[str] = None  # Idempotency key; retries with the same key replay the result
 
 
 class LowerPositionRequest(BaseModel):
@@ -100,9 +228,14 @@ class CheckInResponseRequest(BaseModel):
     response: str  # "better", "same", "worse"
 
 
+class ClaimRequest(BaseModel):
+    department: Optional[str] = None  # Any department when omitted
+    priority_level: Optional[str] = None  # Critical, High, Medium or Low; any level when omitted
+
+
 # HTTP Endpoints
 @app.post("/api/start-triage")
-async def start_triage(request: StartTriageRequest, db: Session = Depends(get_db)):
+async def start_triage(request: StartTriageRequest, db: AsyncSession = Depends(get_db)):
     """Begin triage conversation, create user session"""
     try:
         session_id = str(uuid.uuid4())
@@ -113,8 +246,7 @@ async def start_triage(request: StartTriageRequest, db: Session = Depends(get_db
             phone=request.phone
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
         
         return {
             "session_id": session_id,
@@ -126,47 +258,59 @@ async def start_triage(request: StartTriageRequest, db: Session = Depends(get_db
 
 
 @app.post("/api/message")
-async def send_message(request: MessageRequest, db: Session = Depends(get_db)):
+async def send_message(request: MessageRequest, db: AsyncSession = Depends(get_db)):
     """Send message to Gemini and get response"""
-    user = db.query(User).filter(User.session_id == request.session_id).first()
+    return await session_requests.do(
+        ("message", request.session_id, request.request_id or request.content),
+        lambda: _send_message(request, db),
+        replay_key=("message", request.session_id, request.request_id) if request.request_id else None
+    )
+
+
+async def _send_message(request: MessageRequest, db: AsyncSession):
+    user = await get_user(db, request.session_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get conversation history
-    history = db.query(ConversationHistory).filter(
-        ConversationHistory.user_id == user.id
-    ).order_by(ConversationHistory.timestamp.desc()).first()
+    history = await get_latest_history(db, user.id)
     
-    messages = []
-    if history:
-        messages = history.messages or []
+    # Running summary plus recent turns, compacted if over the context budget
+    store = ConversationStore(db)
+    messages = await load_context(store, user.id, history, gemini_service.summarize_conversation_async)
     
     # Add new user message
-    messages.append({"role": "user", "content": request.content})
+    user_message = {"role": "user", "content": request.content}
+    messages.append(user_message)
     
     # Get user history for misuse detection
     user_history = {
         "misuse_count": user.misuse_count,
         "previous_severities": []
     }
+    # End the transaction so the connection goes back to the pool during the LLM call
+    await db.commit()
     
     # Get AI response
-    ai_response = gemini_service.get_conversation_response(messages, user_history)
-    messages.append({"role": "assistant", "content": ai_response})
+    if request.stream:
+        ai_response = await stream_assistant_reply(request.session_id, messages, user_history)
+    else:
+        ai_response = await gemini_service.chat_response_async(request.session_id, messages, user_history)
+    assistant_message = {"role": "assistant", "content": ai_response}
+    messages.append(assistant_message)
     
-    # Save conversation history
+    # Save only the two new turns
+    await store.append(user.id, [user_message, assistant_message])
     if history:
-        history.messages = messages
         history.timestamp = datetime.utcnow()
     else:
         history = ConversationHistory(
             user_id=user.id,
-            messages=messages,
             triage_result={}
         )
         db.add(history)
     
-    db.commit()
+    await db.commit()
     
     return {
         "response": ai_response,
@@ -175,25 +319,47 @@ async def send_message(request: MessageRequest, db: Session = Depends(get_db)):
 
 
 @app.post("/api/complete-triage")
-async def complete_triage(request: CompleteTriageRequest, db: Session = Depends(get_db)):
+async def complete_triage(request: CompleteTriageRequest, db: AsyncSession = Depends(get_db)):
     """Finalize triage, analyze conversation, add to queue"""
-    user = db.query(User).filter(User.session_id == request.session_id).first()
+    # Any concurrent completion for the same session is a duplicate
+    return await session_requests.do(
+        ("complete-triage", request.session_id),
+        lambda: _complete_triage(request, db),
+        replay_key=("complete-triage", request.session_id, request.request_id) if request.request_id else None
+    )
+
+
+async def _complete_triage(request: CompleteTriageRequest, db: AsyncSession):
+    user = await get_user(db, request.session_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get conversation history
-    history = db.query(ConversationHistory).filter(
-        ConversationHistory.user_id == user.id
-    ).order_by(ConversationHistory.timestamp.desc()).first()
+    history = await get_latest_history(db, user.id)
     
-    if not history or not history.messages:
+    if not history or not await ConversationStore(db).count_messages(user.id):
         raise HTTPException(status_code=400, detail="No conversation found")
+
+    # A retry after the first completion finished: report the place the patient already has
+    queue_manager = QueueManager(db)
+    queue_entry = await queue_manager.get_waiting_entry(user.id)
+    if queue_entry is not None and history.triage_result:
+        await queue_manager.ensure_index()
+        await register_check_ins(request.session_id, manager.connection_id(request.session_id))
+        return triage_response(history.triage_result, queue_entry, department_of(queue_entry),
+                               queue_manager.get_queue_position(user.id) or queue_entry.position)
+
+    messages = await load_context(
+        ConversationStore(db), user.id, history, gemini_service.summarize_conversation_async
+    )
     
     # Get previous severities for misuse detection
-    previous_entries = db.query(QueueEntry).filter(
-        QueueEntry.user_id == user.id,
-        QueueEntry.status != "waiting"  # Get completed/cancelled entries
-    ).all()
+    previous_entries = (await db.execute(
+        select(QueueEntry).where(
+            QueueEntry.user_id == user.id,
+            QueueEntry.status != "waiting"  # Get completed/cancelled entries
+        )
+    )).scalars().all()
     previous_severities = [float(entry.severity_score) for entry in previous_entries]
     
     # Analyze triage
@@ -202,7 +368,19 @@ async def complete_triage(request: CompleteTriageRequest, db: Session = Depends(
         "previous_severities": previous_severities
     }
     
-    triage_result = gemini_service.analyze_triage(history.messages, user_history)
+    # Reuse the analysis of an identical transcript (retries, double submits)
+    cache_key = triage_cache.key(messages, user_history)
+    triage_result = triage_cache.get(cache_key)
+    if triage_result is None and TRIAGE_CACHE_PERSIST and history.triage_result \
+            and history.triage_cache_key == cache_key:
+        triage_result = dict(history.triage_result)
+        triage_cache.put(cache_key, triage_result)
+    if triage_result is None:
+        # End the transaction so the connection goes back to the pool during the LLM call
+        await db.commit()
+        triage_result = await gemini_service.analyze_triage_async(messages, user_history)
+        if triage_result != FALLBACK_TRIAGE:
+            triage_cache.put(cache_key, triage_result)
     
     # Check for misuse
     misuse_check = gemini_service.check_misuse(
@@ -212,15 +390,13 @@ async def complete_triage(request: CompleteTriageRequest, db: Session = Depends(
     
     if misuse_check["is_misuse"]:
         user.misuse_count += 1
-        db.commit()
+        await db.commit()
     
     # Update history with triage result
     history.triage_result = triage_result
-    db.commit()
-    
-    # Add to queue
-    queue_manager = QueueManager(db)
-    queue_entry = queue_manager.add_to_queue(user.id, triage_result["severity_score"])
+    history.triage_cache_key = cache_key if triage_result != FALLBACK_TRIAGE else None
+    await db.commit()
+    gemini_service.end_chat(request.session_id)
     
     # Check if emergency
     emergency = is_emergency(
@@ -228,61 +404,122 @@ async def complete_triage(request: CompleteTriageRequest, db: Session = Depends(
         triage_result["severity_score"]
     )
     
+    # Add to the department's queue
+    department = get_department(triage_result["severity_score"], emergency)
+    queue_entry = await queue_manager.add_to_queue(user.id, triage_result["severity_score"], department)
+    await schedule_next_check_in(queue_entry.id, queue_entry.created_at)
+    
     # Broadcast queue update
-    queue_state = queue_manager.get_queue_state()
-    await manager.broadcast_queue_update(queue_state)
+    await queue_changed(department, queue_entry.id)
     
     # Register for check-ins
-    async def check_in_callback(message: dict):
-        await manager.send_personal_message(message, request.session_id)
-    
-    register_check_in_callback(request.session_id, check_in_callback)
+    await register_check_ins(request.session_id, manager.connection_id(request.session_id))
     
+    return triage_response(triage_result, queue_entry, department, queue_entry.position,
+                           misuse_check["reason"] if misuse_check["is_misuse"] else None)
+
+
+def triage_response(triage_result: Dict, queue_entry: QueueEntry, department: str, queue_position: int,
+                    misuse_warning: Optional[str] = None) -> Dict:
     return {
         "triage_result": triage_result,
-        "queue_position": queue_entry.position,
-        "emergency": emergency,
+        "queue_position": queue_position,
+        "department": department,
+        "emergency": is_emergency(triage_result.get("symptoms_summary", ""), triage_result["severity_score"]),
         "care_recommendation": get_care_recommendation(queue_entry.priority_level),
-        "misuse_warning": misuse_check["reason"] if misuse_check["is_misuse"] else None
+        "misuse_warning": misuse_warning
     }
 
 
 @app.get("/api/queue")
-async def get_queue(db: Session = Depends(get_db)):
-    """Get current queue state"""
-    queue_manager = QueueManager(db)
-    return {"queue": queue_manager.get_queue_state()}
+async def get_queue(department: Optional[str] = None, x_staff_token: Optional[str] = Header(None),
+                    db: AsyncSession = Depends(get_db)):
+    """Get a department's current queue state (staff only)"""
+    if not is_staff(x_staff_token):
+        raise HTTPException(status_code=403, detail="Staff token required")
+    department = resolve_department(department)
+
+    # Publish changes still waiting in the broadcast window so the reply
+    # is current, then return the same encoded snapshot the WebSocket
+    # clients get. Wait times are derived from created_at by the client.
+    queue_feed = queue_feeds[department]
+    if QueueManager(db).version(department) != queue_feed.source_version:
+        await broadcast_queue(department)
+    return Response(content=queue_feed.snapshot(), media_type="application/json")
+
+
+@app.post("/api/queue/claim")
+async def claim_next_patient(request: ClaimRequest, x_staff_token: Optional[str] = Header(None),
+                             db: AsyncSession = Depends(get_db)):
+    """Claim the highest-priority waiting patient for a clinician (staff only)"""
+    if not is_staff(x_staff_token):
+        raise HTTPException(status_code=403, detail="Staff token required")
+    department = resolve_department(request.department) if request.department else None
+    if request.priority_level is not None and request.priority_level not in SEVERITY_LEVELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority level '{request.priority_level}'. Use one of: {', '.join(SEVERITY_LEVELS)}"
+        )
+
+    claim = await QueueManager(db).claim_next(department, request.priority_level)
+    if claim is None:
+        raise HTTPException(status_code=404, detail="No waiting patient matches")
+    department, entry = claim
+    # The leader skips entries that are no longer waiting, so other workers need no event
+    cancel_check_in(entry.entry_id)
+    await queue_changed(department, entry.entry_id)
+    return {
+        "queue_entry_id": entry.entry_id,
+        "user_id": entry.user_id,
+        "department": department,
+        "status": "in_progress",
+        "severity_score": entry.severity_score,
+        "priority_level": entry.priority_level,
+        "created_at": entry.created_at.isoformat(),
+        "wait_time_minutes": round((datetime.utcnow() - entry.created_at).total_seconds() / 60, 1)
+    }
+
+
+@app.get("/api/queue/me")
+async def get_my_queue_position(session_id: str, db: AsyncSession = Depends(get_db)):
+    """Get the patient's own position, people ahead and estimated wait"""
+    user = await get_user(db, session_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return QueueManager(db).get_personal_view(user.id)
 
 
 @app.post("/api/lower-position")
-async def lower_position(request: LowerPositionRequest, db: Session = Depends(get_db)):
+async def lower_position(request: LowerPositionRequest, db: AsyncSession = Depends(get_db)):
     """User-initiated position lowering"""
-    user = db.query(User).filter(User.session_id == request.session_id).first()
+    user = await get_user(db, request.session_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     queue_manager = QueueManager(db)
-    success = queue_manager.lower_position(user.id)
+    success = await queue_manager.lower_position(user.id)
     
     if success:
-        queue_state = queue_manager.get_queue_state()
-        await manager.broadcast_queue_update(queue_state)
-        return {"message": "Position lowered successfully", "queue": queue_state}
+        view = queue_manager.get_personal_view(user.id)
+        await queue_changed(view["department"], view["queue_entry_id"])
+        return {"message": "Position lowered successfully", "queue_position": view}
     else:
         raise HTTPException(status_code=400, detail="Could not lower position")
 
 
 @app.post("/api/check-in-response")
-async def check_in_response(request: CheckInResponseRequest, db: Session = Depends(get_db)):
+async def check_in_response(request: CheckInResponseRequest, db: AsyncSession = Depends(get_db)):
     """Respond to periodic check-in"""
-    user = db.query(User).filter(User.session_id == request.session_id).first()
+    user = await get_user(db, request.session_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    queue_entry = db.query(QueueEntry).filter(
-        QueueEntry.id == request.queue_entry_id,
-        QueueEntry.user_id == user.id
-    ).first()
+    queue_entry = (await db.execute(
+        select(QueueEntry).where(
+            QueueEntry.id == request.queue_entry_id,
+            QueueEntry.user_id == user.id
+        )
+    )).scalars().first()
     
     if not queue_entry:
         raise HTTPException(status_code=404, detail="Queue entry not found")
@@ -299,44 +536,95 @@ async def check_in_response(request: CheckInResponseRequest, db: Session = Depen
     
     # If condition worsened, increase severity
     if request.response == "worse":
-        queue_entry.severity_score = min(10, queue_entry.severity_score + 1)
         queue_manager = QueueManager(db)
-        queue_manager.update_positions()
-        queue_state = queue_manager.get_queue_state()
-        await manager.broadcast_queue_update(queue_state)
+        await queue_manager.update_severity(queue_entry, min(10, queue_entry.severity_score + 1))
+        await queue_changed(department_of(queue_entry), queue_entry.id)
     
-    db.commit()
+    await db.commit()
+    if queue_entry.status == "waiting":
+        await schedule_next_check_in(queue_entry.id, queue_entry.last_check_in)
     
     return {"message": "Check-in response recorded", "response": request.response}
 
 
+async def send_queue_view(session_id: str, view: str, department: Optional[str], queue_manager: QueueManager,
+                          since: Optional[int] = None):
+    """Bring a subscriber up to date: a department's deltas since a seq (or a snapshot), or the patient's own view"""
+    if view == FULL_VIEW:
+        for update in queue_feeds[department].since(since):
+            await manager.send_queue_update(update, session_id)
+    else:
+        await manager.send_personal_view(session_id, queue_manager.get_personal_view, force=True)
+
+
 # WebSocket endpoint
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await manager.connect(websocket, session_id)
+async def websocket_endpoint(websocket: WebSocket, session_id: str, view: str = PERSONAL_VIEW,
+                             token: Optional[str] = None, department: Optional[str] = None):
+    # Patients get their own position; a department's full queue is for staff
+    if view not in (PERSONAL_VIEW, FULL_VIEW) or (view == FULL_VIEW and not is_staff(token)):
+        await websocket.close(code=1008)
+        return
+    if view == FULL_VIEW:
+        department = department or DEFAULT_DEPARTMENT
+        if department not in queue_feeds:
+            await websocket.close(code=1008)
+            return
+    else:
+        department = None  # Follows the patient's queue entry
+
+    async with AsyncSessionLocal() as db:
+        queue_manager = QueueManager(db)
+        user = await get_user(db, session_id) if view == PERSONAL_VIEW else None
+    connection = await manager.connect(websocket, session_id, view, user.id if user else None, department)
+    if user is not None and queue_manager.get_queue_position(user.id) is not None:
+        # Callbacks only live as long as a connection; a reconnect or restart needs them again
+        await register_check_ins(session_id, connection.id)
     
     try:
+        # Start the client from the current queue; updates follow
+        await send_queue_view(session_id, view, department, queue_manager)
         while True:
             data = await websocket.receive_text()
-            # Handle incoming WebSocket messages if needed
-            # For now, just keep connection alive
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            # A client that missed a seq asks to catch up from its last one
+            if isinstance(message, dict) and message.get("type") == "queue_resync":
+                await send_queue_view(session_id, view, department, queue_manager, message.get("since"))
     except WebSocketDisconnect:
-        manager.disconnect(session_id)
-        unregister_check_in_callback(session_id)
+        # A socket replaced by a reconnect leaves the newer connection's check-ins alone. One the
+        # manager already dropped (slow or failed sends) was current until then.
+        if await manager.disconnect(session_id, websocket) or session_id not in manager.active_connections:
+            await unregister_check_ins(session_id, connection.id)
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize scheduler on startup"""
+    """Initialize scheduler on startup; check-ins run in whichever worker is elected"""
     start_scheduler()
+    async with AsyncSessionLocal() as db:
+        queue_manager = QueueManager(db)
+        await queue_manager.ensure_index()
+        for department, queue_feed in queue_feeds.items():
+            queue_feed.publish(
+                queue_manager.get_queue_state(department), queue_manager.version(department),
+                queue_manager.wait_estimate(department)
+            )
+            schedule_queue_reorder(department, queue_manager.next_reorder_at(department), broadcast_reordered_queue)
+    await bus.start(lead_check_ins)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Stop scheduler on shutdown"""
+    """Stop scheduler and WebSocket writers, hand over leadership and close pooled database connections on shutdown"""
     from app.scheduler import scheduler
     if scheduler.running:
         scheduler.shutdown()
+    await manager.shutdown()
+    await bus.stop()
+    await async_engine.dispose()
 
 
 @app.get("/")
@@ -344,6 +632,21 @@ async def root():
     return {"message": "MediQueue API", "status": "running"}
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Get in-process cache and performance counters"""
+    return {
+        "triage_cache": triage_cache.stats(),
+        "chat_sessions": gemini_service.chat_sessions.stats(),
+        "session_requests": session_requests.stats(),
+        "queue_feeds": {department: queue_feed.stats() for department, queue_feed in queue_feeds.items()},
+        "queue_broadcasts": {department: coalescer.stats() for department, coalescer in queue_broadcasts.items()},
+        "wait_estimates": wait_estimate_stats(),
+        "websockets": manager.stats(),
+        "event_bus": bus.stats()
+    }
+
+
 @app.get("/api/model-info")
 async def get_model_info():
     """Get information about the Gemini model being used"""
@@ -1,17 +1,28 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, JSON, ForeignKey, Boolean
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Float, DateTime, JSON, ForeignKey, Boolean, Text, Index, null
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from contextlib import contextmanager
 from datetime import datetime
 import os
 from dotenv import load_dotenv
+from app.triage_logic import DEFAULT_DEPARTMENT
 
 load_dotenv()
 
+try:
+    import fcntl
+except ImportError:  # Windows: no multi-worker support, so no lock needed
+    fcntl = None
+
 # Get the backend directory (parent of app directory)
 # Use __file__ to get the absolute path of this module
 current_file_dir = os.path.dirname(os.path.abspath(__file__))
 backend_dir = os.path.dirname(current_file_dir)
-db_path = os.path.join(backend_dir, "database.db")
+# DATABASE_PATH lets tools such as the benchmark use a separate file; relative
+# paths are resolved against the backend directory
+db_path = os.path.join(backend_dir, os.getenv("DATABASE_PATH", "database.db"))
 
 # Ensure the directory exists
 os.makedirs(backend_dir, exist_ok=True)
@@ -22,8 +33,50 @@ db_path_absolute = os.path.abspath(db_path)
 # SQLAlchemy SQLite format: sqlite:////absolute/path (4 slashes for absolute paths)
 # Always use the computed absolute path, ignoring DATABASE_URL from .env if it's relative
 DATABASE_URL = f"sqlite:///{db_path_absolute}"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{db_path_absolute}"
+
+# SQLite tuning. WAL lets readers run alongside the single writer; with WAL,
+# synchronous=NORMAL only fsyncs at checkpoints and stays crash-safe.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))  # Wait for the write lock
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+
+# Synchronous engine for migrations at startup and command-line scripts
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine used by the API, so database I/O does not block the event loop
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,  # aiosqlite defaults to opening a connection per checkout
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+)
+
+# Objects stay readable after commit; lazy loads are not available in async code
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, expire_on_commit=False, autoflush=False
+)
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
 Base = declarative_base()
 
 
@@ -39,20 +92,27 @@ class User(Base):
     
     queue_entries = relationship("QueueEntry", back_populates="user")
     conversation_histories = relationship("ConversationHistory", back_populates="user")
+    conversation_messages = relationship("ConversationMessage", back_populates="user")
     check_in_logs = relationship("CheckInLog", back_populates="user")
 
 
 class QueueEntry(Base):
     __tablename__ = "queue_entries"
+    __table_args__ = (
+        Index("ix_queue_entries_status_position", "status", "position"),  # Waiting queue in order
+        Index("ix_queue_entries_user_status", "user_id", "status"),  # A user's waiting/past entries
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     severity_score = Column(Float)
     priority_score = Column(Float)
     priority_level = Column(String)  # Critical, High, Medium, Low
+    priority_offset = Column(Float, default=0)  # Penalty from user-initiated lowering
     wait_time_minutes = Column(Float, default=0)
     position = Column(Integer)
     status = Column(String, default="waiting")  # waiting, in_progress, completed, cancelled
+    department = Column(String, default=DEFAULT_DEPARTMENT)  # Which queue the entry waits in
     created_at = Column(DateTime, default=datetime.utcnow)
     last_check_in = Column(DateTime, nullable=True)
     
@@ -62,16 +122,38 @@ class QueueEntry(Base):
 
 class ConversationHistory(Base):
     __tablename__ = "conversation_histories"
+    __table_args__ = (
+        Index("ix_conversation_histories_user_timestamp", "user_id", "timestamp"),  # Latest history per user
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    messages = Column(JSON)  # List of message objects
+    messages = Column(JSON)  # Legacy message list, moved to conversation_messages by init_db
     triage_result = Column(JSON)  # {severity, guidance, emergency_flag}
+    triage_cache_key = Column(String, nullable=True)  # TriageCache key triage_result was computed for
+    summary = Column(Text, nullable=True)  # Running summary of compacted older turns
+    summary_through = Column(Integer, default=0)  # Last message sequence folded into summary
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="conversation_histories")
 
 
+class ConversationMessage(Base):
+    __tablename__ = "conversation_messages"
+    __table_args__ = (
+        Index("ix_conversation_messages_user_sequence", "user_id", "sequence", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)  # 1-based turn number per user
+    role = Column(String)  # user, assistant
+    content = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    user = relationship("User", back_populates="conversation_messages")
+
+
 class CheckInLog(Base):
     __tablename__ = "check_in_logs"
     
@@ -85,6 +167,105 @@ class CheckInLog(Base):
     queue_entry = relationship("QueueEntry", back_populates="check_in_logs")
 
 
+class BusEvent(Base):
+    """An event published to the other worker processes (see app/event_bus.py)"""
+    __tablename__ = "bus_events"
+    __table_args__ = {"sqlite_autoincrement": True}  # Ids never go backwards after pruning
+
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, nullable=False)
+    payload = Column(JSON)
+    origin = Column(String, nullable=False)  # Publishing worker, which skips its own events
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class LeaderLease(Base):
+    """Which worker currently holds a process-wide role, and until when"""
+    __tablename__ = "leader_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=False)
+
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    with _migration_lock():
+        Base.metadata.create_all(bind=engine)
+        _add_missing_columns()
+        _add_missing_indexes()
+        _migrate_conversation_messages()
+
+
+@contextmanager
+def _migration_lock():
+    """Let one process at a time migrate; workers started together all call init_db"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{db_path_absolute}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _add_missing_columns():
+    """Add columns introduced after a database file was created"""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {column.default.arg!r}"
+                connection.execute(text(ddl))
+
+
+def _add_missing_indexes():
+    """Create indexes declared after a database file was created.
+
+    create_all only builds indexes together with a new table, so indexes
+    added to an existing table are created here.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    print(f"Creating index {index.name} on {table.name}")
+                    index.create(bind=connection)
+
 
+def _migrate_conversation_messages():
+    """Move messages from the legacy JSON column into conversation_messages rows"""
+    db = SessionLocal()
+    try:
+        histories = db.query(ConversationHistory).filter(
+            ConversationHistory.messages.isnot(None)
+        ).order_by(ConversationHistory.timestamp).all()
+        for history in histories:
+            if not history.messages:
+                history.messages = null()
+                continue
+            last_sequence = db.query(ConversationMessage.sequence).filter(
+                ConversationMessage.user_id == history.user_id
+            ).order_by(ConversationMessage.sequence.desc()).limit(1).scalar() or 0
+            for sequence, message in enumerate(history.messages, start=last_sequence + 1):
+                db.add(ConversationMessage(
+                    user_id=history.user_id,
+                    sequence=sequence,
+                    role=message.get("role", "user"),
+                    content=message.get("content", ""),
+                    created_at=history.timestamp
+                ))
+            # SQL NULL rather than JSON null, so the row is skipped next time
+            history.messages = null()
+        db.commit()
+    finally:
+        db.close()
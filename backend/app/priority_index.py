@@ -0,0 +1,471 @@
+"""
+In-memory priority index for the waiting queue.
+
+Priority follows the queue formula
+
+    priority(t) = SEVERITY_WEIGHT * severity
+                  + WAIT_WEIGHT * min(wait(t) / MAX_WAIT, 1) * 10
+                  - offset
+
+Every entry that has not yet hit the wait cap ages at the same rate, so the
+order among "aging" entries never changes over time and can be keyed on a
+time-invariant value. Entries past the cap have a constant priority. The
+index keeps both groups in order-statistic trees, which gives O(log n)
+inserts, removals and position lookups at any point in time without ever
+rescoring the whole queue. A second pair of trees per priority level gives
+the head of any one level in O(log n) as well.
+
+The merged order only changes when a rising entry overtakes one that has
+stopped aging, and those crossover instants can be computed in advance. The
+full ordering is therefore cached as a snapshot that stays valid until the
+next crossover or the next mutation.
+"""
+
+import heapq
+import math
+import random
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.rescoring import index_keys, tree_layout
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_minutes(moment: datetime) -> float:
+    """Convert a naive UTC datetime to minutes since the epoch"""
+    return (moment - EPOCH).total_seconds() / 60
+
+
+class _Node:
+    __slots__ = ("key", "weight", "left", "right", "size")
+
+    def __init__(self, key, weight: Optional[float] = None):
+        self.key = key
+        self.weight = random.random() if weight is None else weight
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node else 0
+
+
+def _update(node: _Node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node: Optional[_Node], key) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Split a treap into (keys < key, keys >= key)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        _update(node)
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    _update(node)
+    return left, node
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """Merge two treaps where every key in left is smaller than every key in right"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.weight > right.weight:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _pop_min(node: _Node) -> Optional[_Node]:
+    if node.left is None:
+        return node.right
+    node.left = _pop_min(node.left)
+    _update(node)
+    return node
+
+
+class OrderStatisticTree:
+    """Treap of unique, comparable keys augmented with subtree sizes"""
+
+    def __init__(self):
+        self._root: Optional[_Node] = None
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def insert(self, key):
+        left, right = _split(self._root, key)
+        self._root = _merge(_merge(left, _Node(key)), right)
+
+    def build(self, keys: List):
+        """Replace the contents with already sorted, unique keys in O(n)
+
+        Builds a balanced tree directly. Each node weighs size / (size + 1),
+        the expected largest of that many random weights, so parents always
+        outweigh their children and later random inserts settle at the depth
+        they would in a treap built one insert at a time.
+        """
+        if not keys:
+            self._root = None
+            return
+        root, lefts, rights, sizes = tree_layout(len(keys))
+        nodes = [_Node(key, size / (size + 1)) for key, size in zip(keys, sizes)]
+        nodes.append(None)  # Child -1
+        for node, left, right, size in zip(nodes, lefts, rights, sizes):
+            node.left = nodes[left]
+            node.right = nodes[right]
+            node.size = size
+        self._root = nodes[root]
+
+    def remove(self, key):
+        left, right = _split(self._root, key)
+        if right is None or self._min_key(right) != key:
+            self._root = _merge(left, right)
+            raise KeyError(key)
+        self._root = _merge(left, _pop_min(right))
+
+    def rank(self, key) -> int:
+        """Number of keys strictly smaller than key"""
+        count = 0
+        node = self._root
+        while node is not None:
+            if node.key < key:
+                count += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    def first(self):
+        """Smallest key, or None when empty"""
+        return self._min_key(self._root) if self._root is not None else None
+
+    def kth(self, k: int):
+        """Key at zero-based rank k"""
+        node = self._root
+        while node is not None:
+            left_size = _size(node.left)
+            if k < left_size:
+                node = node.left
+            elif k == left_size:
+                return node.key
+            else:
+                k -= left_size + 1
+                node = node.right
+        raise IndexError(k)
+
+    def __iter__(self) -> Iterator:
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.key
+            node = node.right
+
+    def clear(self):
+        self._root = None
+
+    @staticmethod
+    def _min_key(node: _Node):
+        while node.left is not None:
+            node = node.left
+        return node.key
+
+
+class IndexedEntry:
+    """Snapshot of the queue entry fields the index needs"""
+
+    __slots__ = (
+        "entry_id", "user_id", "severity_score", "priority_level",
+        "created_at", "created_minutes", "offset", "saturated", "key",
+    )
+
+    def __init__(self, entry_id: int, user_id: int, severity_score: float,
+                 priority_level: str, created_at: datetime, offset: float = 0.0):
+        self.entry_id = entry_id
+        self.user_id = user_id
+        self.severity_score = severity_score
+        self.priority_level = priority_level
+        self.created_at = created_at
+        self.created_minutes = to_minutes(created_at)
+        self.offset = offset or 0.0
+        self.saturated = False
+        self.key: Tuple[float, int] = (0.0, entry_id)
+
+
+class QueueSnapshot:
+    """Queue order that holds from computed_at until valid_until (epoch minutes)"""
+
+    __slots__ = ("version", "entries", "positions", "computed_at", "valid_until")
+
+    def __init__(self, version: int, entries: List[IndexedEntry], computed_at: float,
+                 valid_until: float):
+        self.version = version
+        self.entries = entries
+        self.positions = {entry.entry_id: position for position, entry in enumerate(entries, start=1)}
+        self.computed_at = computed_at
+        self.valid_until = valid_until
+
+    def is_current(self, version: int, now: float) -> bool:
+        return self.version == version and self.computed_at <= now < self.valid_until
+
+
+class PriorityIndex:
+    """Order-statistic index over waiting entries, split into aging and saturated groups"""
+
+    def __init__(self, severity_weight: float, wait_weight: float, max_wait_minutes: float):
+        self.severity_weight = severity_weight
+        self.wait_weight = wait_weight
+        self.max_wait_minutes = max_wait_minutes
+        # Priority gained per minute of waiting until the cap is reached
+        self.slope = wait_weight * 10 / max_wait_minutes
+        self.loaded = False
+        # Bumped on every insert or removal; snapshots from older versions are stale
+        self.version = 0
+        self._snapshot: Optional[QueueSnapshot] = None
+        self._entries: Dict[int, IndexedEntry] = {}
+        self._by_user: Dict[int, int] = {}
+        self._aging = OrderStatisticTree()
+        self._saturated = OrderStatisticTree()
+        # (aging, saturated) trees per priority level, holding the same keys again
+        self._levels: Dict[str, Tuple[OrderStatisticTree, OrderStatisticTree]] = {}
+        self._saturation_heap: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, entry_id: int) -> bool:
+        return entry_id in self._entries
+
+    def load(self, entries: List[IndexedEntry], now: Optional[float] = None):
+        """Replace the index contents, computing every key in one batch and building the trees in one pass"""
+        self.clear()
+        now = self._now(now)
+        saturated, firsts, order = index_keys(
+            [entry.entry_id for entry in entries], [entry.severity_score for entry in entries],
+            [entry.created_minutes for entry in entries], [entry.offset for entry in entries],
+            now, self.severity_weight, self.wait_weight, self.max_wait_minutes
+        )
+        for entry, is_saturated, first in zip(entries, saturated, firsts):
+            entry.saturated = is_saturated
+            entry.key = (first, entry.entry_id)
+        self._entries = {entry.entry_id: entry for entry in entries}
+        self._by_user = {entry.user_id: entry.entry_id for entry in entries}
+
+        aging_count = len(order) - sum(saturated)
+        ordered = [entries[i] for i in order]
+        for group, (tree, group_entries) in enumerate((
+            (self._aging, ordered[:aging_count]), (self._saturated, ordered[aging_count:])
+        )):
+            tree.build([entry.key for entry in group_entries])
+            by_level: Dict[str, List[Tuple[float, int]]] = {}
+            for entry in group_entries:
+                by_level.setdefault(entry.priority_level, []).append(entry.key)
+            for level, level_keys in by_level.items():
+                self._level_trees(level)[group].build(level_keys)
+
+        self._saturation_heap = [
+            (entry.created_minutes + self.max_wait_minutes, entry.entry_id) for entry in ordered[:aging_count]
+        ]
+        heapq.heapify(self._saturation_heap)
+        self.loaded = True
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+        self._aging.clear()
+        self._saturated.clear()
+        self._levels.clear()
+        self._saturation_heap = []
+        self._snapshot = None
+        self.version += 1
+        self.loaded = False
+
+    def get(self, entry_id: int) -> Optional[IndexedEntry]:
+        return self._entries.get(entry_id)
+
+    def entry_for_user(self, user_id: int) -> Optional[IndexedEntry]:
+        entry_id = self._by_user.get(user_id)
+        return self._entries.get(entry_id) if entry_id is not None else None
+
+    def insert(self, entry: IndexedEntry, now: Optional[float] = None):
+        """Add an entry; now is in epoch minutes and defaults to the current time"""
+        if entry.entry_id in self._entries:
+            self.remove(entry.entry_id)
+        now = self._now(now)
+        saturate_at = entry.created_minutes + self.max_wait_minutes
+        entry.saturated = saturate_at <= now
+        entry.key = self._key(entry)
+        self._tree(entry).insert(entry.key)
+        self._level_tree(entry).insert(entry.key)
+        if not entry.saturated:
+            heapq.heappush(self._saturation_heap, (saturate_at, entry.entry_id))
+        self._entries[entry.entry_id] = entry
+        self._by_user[entry.user_id] = entry.entry_id
+        self.version += 1
+
+    def remove(self, entry_id: int) -> Optional[IndexedEntry]:
+        """Drop an entry; stale saturation heap items are skipped lazily"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return None
+        self._tree(entry).remove(entry.key)
+        self._level_tree(entry).remove(entry.key)
+        if self._by_user.get(entry.user_id) == entry_id:
+            del self._by_user[entry.user_id]
+        self.version += 1
+        return entry
+
+    def priority(self, entry_id: int, now: Optional[float] = None) -> float:
+        entry = self._entries[entry_id]
+        return self._priority(entry, self._now(now))
+
+    def position(self, entry_id: int, now: Optional[float] = None) -> int:
+        """1-based queue position of an entry at the given time"""
+        now = self._advance(now)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.is_current(self.version, now):
+            return snapshot.positions[entry_id]
+        entry = self._entries[entry_id]
+        if entry.saturated:
+            # Aging entries ahead have a + slope * now > c, i.e. key < -(c - slope * now)
+            threshold = (-(-entry.key[0] - self.slope * now), entry.entry_id)
+            ahead = self._saturated.rank(entry.key) + self._aging.rank(threshold)
+        else:
+            threshold = (entry.key[0] - self.slope * now, entry.entry_id)
+            ahead = self._aging.rank(entry.key) + self._saturated.rank(threshold)
+        return ahead + 1
+
+    def peek(self, now: Optional[float] = None, priority_level: Optional[str] = None) -> Optional[IndexedEntry]:
+        """Highest-priority entry at the given time, optionally of one level, or None, in O(log n)"""
+        now = self._advance(now)
+        if priority_level is None:
+            aging_tree, saturated_tree = self._aging, self._saturated
+        elif priority_level in self._levels:
+            aging_tree, saturated_tree = self._levels[priority_level]
+        else:
+            return None
+        aging = aging_tree.first()
+        saturated = saturated_tree.first()
+        if aging is not None and (saturated is None or (aging[0] - self.slope * now, aging[1]) < saturated):
+            return self._entries[aging[1]]
+        return self._entries[saturated[1]] if saturated is not None else None
+
+    def ordered(self, now: Optional[float] = None) -> List[IndexedEntry]:
+        """All entries in queue order at the given time"""
+        return self.snapshot(now).entries
+
+    def snapshot(self, now: Optional[float] = None) -> QueueSnapshot:
+        """Cached queue order, recomputed only after a mutation or a crossover"""
+        now = self._advance(now)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.is_current(self.version, now):
+            return snapshot
+        entries = self._merge(now)
+        self._snapshot = QueueSnapshot(self.version, entries, now, self._next_crossover(entries, now))
+        return self._snapshot
+
+    def _merge(self, now: float) -> List[IndexedEntry]:
+        return list(self._iter_merged(now))
+
+    def _iter_merged(self, now: float) -> Iterator[IndexedEntry]:
+        """Entries in queue order, produced lazily from both trees"""
+        aging = iter(self._aging)
+        saturated = iter(self._saturated)
+        next_aging = next(aging, None)
+        next_saturated = next(saturated, None)
+        while next_aging is not None or next_saturated is not None:
+            if next_saturated is None or (
+                next_aging is not None
+                and (next_aging[0] - self.slope * now, next_aging[1]) < next_saturated
+            ):
+                yield self._entries[next_aging[1]]
+                next_aging = next(aging, None)
+            else:
+                yield self._entries[next_saturated[1]]
+                next_saturated = next(saturated, None)
+
+    def _next_crossover(self, entries: List[IndexedEntry], now: float) -> float:
+        """Earliest time an entry overtakes the one directly ahead of it
+
+        Only a still-aging entry can overtake, and only once the entry ahead
+        has stopped aging, so it is enough to check adjacent pairs against the
+        priority each entry levels off at.
+        """
+        next_event = math.inf
+        for upper, lower in zip(entries, entries[1:]):
+            if lower.saturated:
+                continue
+            ceiling = self._ceiling(upper)
+            lower_ceiling = self._ceiling(lower)
+            if lower_ceiling < ceiling or (lower_ceiling == ceiling and lower.entry_id > upper.entry_id):
+                continue
+            # Aging priority is slope * t - key[0], so it reaches the ceiling at:
+            crossing = (ceiling + lower.key[0]) / self.slope
+            next_event = min(next_event, max(crossing, now))
+        return next_event
+
+    def _ceiling(self, entry: IndexedEntry) -> float:
+        """Priority an entry levels off at once it reaches the wait cap"""
+        return self.severity_weight * entry.severity_score + self.wait_weight * 10 - entry.offset
+
+    def _priority(self, entry: IndexedEntry, now: float) -> float:
+        wait = max(now - entry.created_minutes, 0.0)
+        normalized_wait = min(wait / self.max_wait_minutes, 1.0)
+        return (
+            self.severity_weight * entry.severity_score +
+            self.wait_weight * (normalized_wait * 10) -
+            entry.offset
+        )
+
+    def _key(self, entry: IndexedEntry) -> Tuple[float, int]:
+        # Keys sort ascending, so negate priorities to get highest first
+        if entry.saturated:
+            return (-self._ceiling(entry), entry.entry_id)
+        base = self.severity_weight * entry.severity_score - entry.offset
+        return (-(base - self.slope * entry.created_minutes), entry.entry_id)
+
+    def _tree(self, entry: IndexedEntry) -> OrderStatisticTree:
+        return self._saturated if entry.saturated else self._aging
+
+    def _level_trees(self, priority_level: str) -> Tuple[OrderStatisticTree, OrderStatisticTree]:
+        trees = self._levels.get(priority_level)
+        if trees is None:
+            trees = self._levels[priority_level] = (OrderStatisticTree(), OrderStatisticTree())
+        return trees
+
+    def _level_tree(self, entry: IndexedEntry) -> OrderStatisticTree:
+        return self._level_trees(entry.priority_level)[1 if entry.saturated else 0]
+
+    def _advance(self, now: Optional[float]) -> float:
+        """Move entries that reached the wait cap into the saturated group"""
+        now = self._now(now)
+        heap = self._saturation_heap
+        while heap and heap[0][0] <= now:
+            _, entry_id = heapq.heappop(heap)
+            entry = self._entries.get(entry_id)
+            if entry is None or entry.saturated:
+                continue
+            self._aging.remove(entry.key)
+            self._level_tree(entry).remove(entry.key)
+            entry.saturated = True
+            entry.key = self._key(entry)
+            self._saturated.insert(entry.key)
+            self._level_tree(entry).insert(entry.key)
+        return now
+
+    @staticmethod
+    def _now(now: Optional[float]) -> float:
+        return to_minutes(datetime.utcnow()) if now is None else now
@@ -0,0 +1,165 @@
+"""
+Versioned queue change feed for WebSocket clients.
+
+Each published queue state gets a sequence number and is sent as a delta
+against the previous one:
+- inserted: entries new to the queue, with their position
+- updated: entries whose severity or priority level changed
+- removed: queue_entry_ids that left the queue
+- moved: [queue_entry_id, position] for entries whose relative order changed
+
+Applying a delta: drop removed, updated and moved entries from the list,
+then splice inserted, updated and moved entries back in at position - 1 in
+ascending position order. Entries not mentioned keep their relative order,
+so clients renumber positions and derive wait times from created_at.
+
+A client that sees a gap in seq asks for a resync and gets the missed
+deltas replayed, or a full snapshot once they have left the history.
+
+Messages are encoded to JSON text once per seq and the same text goes to
+every recipient.
+
+There is one feed per department, each with its own seq; every message
+names the department it belongs to and carries its wait_estimate, the
+learned minutes per patient overall and by level.
+"""
+
+import os
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, List, Optional
+from app.encoding import dumps
+
+QUEUE_FEED_HISTORY = int(os.getenv("QUEUE_FEED_HISTORY", "256"))  # Deltas kept for resync
+# Queue mutations within this window share one recompute and broadcast
+QUEUE_BROADCAST_WINDOW_MS = float(os.getenv("QUEUE_BROADCAST_WINDOW_MS", "50"))
+QUEUE_BROADCAST_MAX_STALENESS_MS = float(os.getenv("QUEUE_BROADCAST_MAX_STALENESS_MS", "250"))
+
+# Fields that change on their own with time, derived by the client
+DERIVED_FIELDS = ("position", "wait_time_minutes")
+
+
+def _stable_order(ids: List[int], old_rank: Dict[int, int]) -> set:
+    """Ids (in new order) forming a longest run that is increasing in old_rank"""
+    tails: List[int] = []  # smallest old rank ending an increasing run of each length
+    tail_index: List[int] = []
+    parents: List[Optional[int]] = []
+    for i, entry_id in enumerate(ids):
+        rank = old_rank[entry_id]
+        length = bisect_left(tails, rank)
+        if length == len(tails):
+            tails.append(rank)
+            tail_index.append(i)
+        else:
+            tails[length] = rank
+            tail_index[length] = i
+        parents.append(tail_index[length - 1] if length else None)
+
+    stable = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        stable.add(ids[i])
+        i = parents[i]
+    return stable
+
+
+class QueueFeed:
+    def __init__(self, department: str, history: int = QUEUE_FEED_HISTORY):
+        self.department = department
+        self.seq = 0
+        self.source_version: Optional[int] = None  # Queue version the current state was built from
+        self.wait_estimate: Optional[Dict] = None
+        self._entries: Dict[int, Dict] = {}  # queue_entry_id -> entry without derived fields
+        self._order: List[int] = []
+        self._history: deque = deque(maxlen=history)  # (seq, encoded delta), oldest first
+        self._snapshot: Optional[str] = None  # Encoded snapshot at seq
+        self.deltas = 0
+        self.snapshots = 0
+        self.replays = 0
+
+    def publish(self, queue_state: List[Dict], source_version: Optional[int] = None,
+                wait_estimate: Optional[Dict] = None) -> Optional[str]:
+        """Record a new queue state and return its encoded delta, or None if nothing changed"""
+        self.source_version = source_version
+        if wait_estimate != self.wait_estimate:
+            self.wait_estimate = wait_estimate
+            self._snapshot = None
+        entries = {
+            entry["queue_entry_id"]: {k: v for k, v in entry.items() if k not in DERIVED_FIELDS}
+            for entry in queue_state
+        }
+        order = [entry["queue_entry_id"] for entry in queue_state]
+
+        removed = [entry_id for entry_id in self._order if entry_id not in entries]
+        inserted, updated, kept = [], [], []
+        for position, entry_id in enumerate(order, start=1):
+            previous = self._entries.get(entry_id)
+            if previous is None:
+                inserted.append(dict(entries[entry_id], position=position))
+            elif previous != entries[entry_id]:
+                updated.append(dict(entries[entry_id], position=position))
+            else:
+                kept.append(entry_id)
+
+        old_rank = {entry_id: rank for rank, entry_id in enumerate(self._order)}
+        stable = _stable_order(kept, old_rank)
+        new_position = {entry_id: position for position, entry_id in enumerate(order, start=1)}
+        moved = [[entry_id, new_position[entry_id]] for entry_id in kept if entry_id not in stable]
+
+        self._entries = entries
+        self._order = order
+        if self.seq and not (inserted or updated or removed or moved):
+            return None
+
+        self.seq += 1
+        delta = {
+            "type": "queue_delta",
+            "department": self.department,
+            "seq": self.seq,
+            "inserted": inserted,
+            "updated": updated,
+            "removed": removed,
+            "moved": moved,
+            "wait_estimate": self.wait_estimate,
+        }
+        encoded = dumps(delta)
+        self._history.append((self.seq, encoded))
+        self._snapshot = None
+        self.deltas += 1
+        return encoded
+
+    def snapshot(self) -> str:
+        """Encoded full state at the current seq"""
+        if self._snapshot is None:
+            self.snapshots += 1
+            self._snapshot = dumps({
+                "type": "queue_snapshot",
+                "department": self.department,
+                "seq": self.seq,
+                "queue": [
+                    dict(self._entries[entry_id], position=position)
+                    for position, entry_id in enumerate(self._order, start=1)
+                ],
+                "wait_estimate": self.wait_estimate,
+            })
+        return self._snapshot
+
+    def since(self, seq: Optional[int]) -> List[str]:
+        """Messages that bring a client at seq up to date"""
+        if seq is None or seq > self.seq:
+            return [self.snapshot()]
+        if seq == self.seq:
+            return []
+        if not self._history or self._history[0][0] > seq + 1:
+            return [self.snapshot()]
+        self.replays += 1
+        return [encoded for delta_seq, encoded in self._history if delta_seq > seq]
+
+    def stats(self) -> Dict:
+        return {
+            "seq": self.seq,
+            "size": len(self._order),
+            "deltas": self.deltas,
+            "snapshots": self.snapshots,
+            "replays": self.replays,
+        }
@@ -1,142 +1,422 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Column, Float, Integer, MetaData, Table, delete, desc, func, insert, select, update
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Set, Tuple
+import threading
 from app.models import QueueEntry, User
-from app.triage_logic import get_severity_level
+from app.priority_index import PriorityIndex, IndexedEntry, EPOCH, to_minutes
+from app.rescoring import gc_paused, rescore
+from app.triage_logic import get_severity_level, DEPARTMENTS, DEFAULT_DEPARTMENT
+from app.wait_estimator import WaitEstimator
 
 SEVERITY_WEIGHT = 0.7
 WAIT_WEIGHT = 0.3
 MAX_WAIT_THRESHOLD_MINUTES = 120  # 2 hours max wait normalization
+REORDER_GRACE_SECONDS = 1  # Fire reorder events just after the crossover instant
+LOWER_POSITION_FACTOR = 0.8  # Lowering keeps 80% of the current priority
+
+# Process-wide index of waiting entries, one per department, so work on
+# one queue never touches another. The database stays the source of
+# truth; every mutation below writes through to both. The lock is never
+# held across an await: the index is updated first and reverted if the
+# commit fails.
+_indexes: Dict[str, PriorityIndex] = {
+    department: PriorityIndex(SEVERITY_WEIGHT, WAIT_WEIGHT, MAX_WAIT_THRESHOLD_MINUTES)
+    for department in DEPARTMENTS
+}
+_index_lock = threading.RLock()
+# Scratch table for update_positions' write-back. Temporary tables live per
+# connection, so it has its own metadata and init_db never creates it.
+_rescored_entries = Table(
+    "rescored_entries", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("priority_score", Float),
+    Column("position", Integer),
+    Column("wait_time_minutes", Float),
+    prefixes=["TEMPORARY"],
+)
+# Each department's throughput, learned from entries leaving its queue
+_wait_estimators: Dict[str, WaitEstimator] = {department: WaitEstimator() for department in DEPARTMENTS}
+
+
+def department_of(entry: QueueEntry) -> str:
+    """The entry's queue, with entries from unknown departments kept in the default one"""
+    return entry.department if entry.department in _indexes else DEFAULT_DEPARTMENT
+
+
+def _indexed(entry: QueueEntry) -> IndexedEntry:
+    return IndexedEntry(
+        entry_id=entry.id,
+        user_id=entry.user_id,
+        severity_score=entry.severity_score,
+        priority_level=entry.priority_level,
+        created_at=entry.created_at,
+        offset=entry.priority_offset or 0.0,
+    )
+
+
+def wait_estimate_stats() -> Dict[str, Dict]:
+    return {department: estimator.stats() for department, estimator in _wait_estimators.items()}
 
 
 class QueueManager:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
+        self.indexes = _indexes
+        self.wait_estimators = _wait_estimators
+
+    async def ensure_index(self):
+        """Load waiting entries into the indexes the first time they are used.
+
+        Called at startup and by every mutation; reads assume it has run.
+        """
+        if all(index.loaded for index in self.indexes.values()):
+            return
+        entries, groups, _ = await self._read_waiting()
+        with _index_lock:
+            if not all(index.loaded for index in self.indexes.values()):
+                self._load_indexes(entries, groups, to_minutes(datetime.utcnow()))
+
+    async def add_to_queue(self, user_id: int, severity_score: float,
+                           department: str = DEFAULT_DEPARTMENT) -> QueueEntry:
+        """Add user to a department's queue with calculated priority
+
+        A user who is already waiting keeps their entry, which is returned
+        instead of a second one.
+        """
+        await self.ensure_index()
+        existing = await self.get_waiting_entry(user_id)
+        if existing is not None:
+            return existing
 
-    def add_to_queue(self, user_id: int, severity_score: float) -> QueueEntry:
-        """Add user to queue with calculated priority"""
         # Calculate initial priority score
         priority_score = self._calculate_priority_score(severity_score, 0)
         priority_level = get_severity_level(severity_score)
-        
+
         # Create queue entry
         queue_entry = QueueEntry(
             user_id=user_id,
             severity_score=severity_score,
             priority_score=priority_score,
             priority_level=priority_level,
+            priority_offset=0.0,
             position=0,  # Will be updated
-            status="waiting"
+            status="waiting",
+            department=department,
+            created_at=datetime.utcnow()
         )
-        
+
         self.db.add(queue_entry)
-        self.db.commit()
-        self.db.refresh(queue_entry)
-        
-        # Update all positions
-        self.update_positions()
-        
+        await self.db.flush()
+
+        index = self.indexes[department_of(queue_entry)]
+        with _index_lock:
+            index.insert(_indexed(queue_entry))
+            queue_entry.position = index.position(queue_entry.id)
+        try:
+            await self.db.commit()
+        except Exception:
+            with _index_lock:
+                index.remove(queue_entry.id)
+            raise
+
+        await self.db.refresh(queue_entry)
         return queue_entry
 
-    def update_positions(self):
-        """Recalculate all queue positions based on current priority scores"""
-        # Update priority scores based on wait time
-        queue_entries = self.db.query(QueueEntry).filter(
-            QueueEntry.status == "waiting"
-        ).all()
-        
-        current_time = datetime.utcnow()
-        
-        for entry in queue_entries:
-            wait_time_minutes = (current_time - entry.created_at).total_seconds() / 60
-            entry.wait_time_minutes = wait_time_minutes
-            
-            # Recalculate priority with updated wait time
-            normalized_wait = min(wait_time_minutes / MAX_WAIT_THRESHOLD_MINUTES, 1.0)
-            entry.priority_score = (
-                SEVERITY_WEIGHT * entry.severity_score +
-                WAIT_WEIGHT * (normalized_wait * 10)  # Scale to 1-10 range
+    async def update_positions(self):
+        """Full rescore: persist every waiting entry's priority and position, then rebuild the indexes
+
+        Reads no longer need this; it is kept for audits, policy changes and
+        for resyncing after the database was changed outside this process.
+        Works on columns rather than ORM objects: priorities and positions
+        are computed in one batch, and the rows whose stored priority or
+        position changed are written back by one UPDATE joined against a
+        temporary table. The stored wait is refreshed on those rows only;
+        readers derive the wait from created_at.
+        """
+        entries, groups, stored = await self._read_waiting()
+        now = to_minutes(datetime.utcnow())
+        priorities, positions, waits = rescore(
+            [entry.entry_id for entry in entries], groups,
+            [entry.severity_score for entry in entries],
+            [entry.created_minutes for entry in entries],
+            [entry.offset for entry in entries],
+            now, SEVERITY_WEIGHT, WAIT_WEIGHT, MAX_WAIT_THRESHOLD_MINUTES
+        )
+
+        changed = [
+            (entry.entry_id, priority, position, wait)
+            for entry, (stored_priority, stored_position), priority, position, wait
+            in zip(entries, stored, priorities, positions, waits)
+            if position != stored_position or priority != stored_priority
+        ]
+        if changed:
+            table = QueueEntry.__table__
+            connection = await self.db.connection()
+            await connection.run_sync(_rescored_entries.create, checkfirst=True)
+            # Rows go to the driver as tuples in column order: a parameter dict per row costs twice the insert
+            await connection.exec_driver_sql(str(insert(_rescored_entries).compile(dialect=connection.dialect)), changed)
+            await connection.execute(
+                update(table).where(table.c.id == _rescored_entries.c.id).values(
+                    priority_score=_rescored_entries.c.priority_score,
+                    position=_rescored_entries.c.position,
+                    wait_time_minutes=_rescored_entries.c.wait_time_minutes,
+                )
             )
-        
-        self.db.commit()
-        
-        # Sort by priority score (descending) and assign positions
-        sorted_entries = sorted(queue_entries, key=lambda x: x.priority_score, reverse=True)
-        
-        for position, entry in enumerate(sorted_entries, start=1):
-            entry.position = position
-        
-        self.db.commit()
+            await connection.execute(delete(_rescored_entries))
+        await self.db.commit()
+
+        with _index_lock:
+            self._load_indexes(entries, groups, now)
+
+    async def reload_entries(self, entry_ids: List[int]) -> Set[str]:
+        """Bring the indexes in line with the database for entries another worker changed.
+
+        Returns the departments whose queue changed.
+        """
+        await self.ensure_index()
+        entries = (await self.db.execute(
+            select(QueueEntry).where(QueueEntry.id.in_(entry_ids))
+        )).scalars().all()
+        waiting = {entry.id: entry for entry in entries if entry.status == "waiting"}
+
+        changed = set()
+        now = datetime.utcnow()
+        with _index_lock:
+            for entry_id in entry_ids:
+                current = self._department_of_entry(entry_id)
+                if current is not None:
+                    indexed = self.indexes[current].remove(entry_id)
+                    changed.add(current)
+                    if entry_id not in waiting:
+                        # Left the queue in another worker; the poll delay is negligible here
+                        self.wait_estimators[current].observe(indexed.priority_level, indexed.created_at, now)
+                if entry_id in waiting:
+                    department = department_of(waiting[entry_id])
+                    self.indexes[department].insert(_indexed(waiting[entry_id]))
+                    changed.add(department)
+        return changed
 
     def get_queue_position(self, user_id: int) -> Optional[int]:
-        """Get current queue position for user"""
-        entry = self.db.query(QueueEntry).filter(
-            QueueEntry.user_id == user_id,
-            QueueEntry.status == "waiting"
-        ).first()
-        
-        if entry:
-            self.update_positions()  # Ensure positions are current
-            self.db.refresh(entry)
-            return entry.position
-        return None
+        """Get current queue position for user within their department"""
+        with _index_lock:
+            department, indexed = self._find_user(user_id)
+            if indexed is None:
+                return None
+            return self.indexes[department].position(indexed.entry_id)
+
+    def get_queue_state(self, department: str = DEFAULT_DEPARTMENT) -> List[Dict]:
+        """Get current queue state for the users waiting in one department"""
+        current_time = datetime.utcnow()
+
+        with _index_lock:
+            entries = self.indexes[department].snapshot(to_minutes(current_time)).entries
 
-    def get_queue_state(self) -> List[Dict]:
-        """Get current queue state for all waiting users"""
-        self.update_positions()
-        
-        entries = self.db.query(QueueEntry).filter(
-            QueueEntry.status == "waiting"
-        ).order_by(QueueEntry.position).all()
-        
         return [
             {
-                "queue_entry_id": entry.id,
+                "queue_entry_id": entry.entry_id,
                 "user_id": entry.user_id,
-                "position": entry.position,
+                "position": position,
                 "severity_score": entry.severity_score,
                 "priority_level": entry.priority_level,
-                "wait_time_minutes": round(entry.wait_time_minutes, 1),
+                "wait_time_minutes": round((current_time - entry.created_at).total_seconds() / 60, 1),
                 "created_at": entry.created_at.isoformat()
             }
-            for entry in entries
+            for position, entry in enumerate(entries, start=1)
         ]
 
-    def lower_position(self, user_id: int) -> bool:
+    def get_personal_view(self, user_id: int) -> Dict:
+        """One patient's place in their department's queue, without anyone else's details"""
+        with _index_lock:
+            department, indexed = self._find_user(user_id)
+            if indexed is None:
+                return {"queue_entry_id": None, "position": None, "department": None}
+            # Shared with the broadcast that usually triggers this call
+            snapshot = self.indexes[department].snapshot()
+            position = snapshot.positions[indexed.entry_id]
+            estimated_wait = self.wait_estimators[department].wait_minutes(snapshot, position)
+
+        return {
+            "queue_entry_id": indexed.entry_id,
+            "department": department,
+            "position": position,
+            "ahead": position - 1,
+            "estimated_wait_minutes": estimated_wait,
+            "severity_score": indexed.severity_score,
+            "priority_level": indexed.priority_level,
+            "created_at": indexed.created_at.isoformat()
+        }
+
+    def version(self, department: str) -> int:
+        """Changes whenever a waiting entry in the department is added, removed or rescored"""
+        return self.indexes[department].version
+
+    def next_reorder_at(self, department: str) -> Optional[datetime]:
+        """When aging alone will next change a department's order, or None if it never will"""
+        with _index_lock:
+            valid_until = self.indexes[department].snapshot().valid_until
+        if valid_until == float("inf"):
+            return None
+        return EPOCH + timedelta(minutes=valid_until, seconds=REORDER_GRACE_SECONDS)
+
+    async def lower_position(self, user_id: int) -> bool:
         """User-initiated position lowering"""
-        entry = self.db.query(QueueEntry).filter(
-            QueueEntry.user_id == user_id,
-            QueueEntry.status == "waiting"
-        ).first()
-        
+        await self.ensure_index()
+        entry = await self.get_waiting_entry(user_id)
         if not entry:
             return False
-        
-        # Reduce priority score by decreasing severity weight
-        # This effectively moves them down in the queue
-        entry.priority_score = entry.priority_score * 0.8  # Reduce by 20%
-        self.db.commit()
-        
-        self.update_positions()
+
+        with _index_lock:
+            # Reduce the current priority by 20%. The reduction is kept as a
+            # fixed offset so the entry keeps aging at the normal rate.
+            current_priority = self.indexes[department_of(entry)].priority(entry.id)
+            entry.priority_offset = (entry.priority_offset or 0.0) + (
+                current_priority * (1 - LOWER_POSITION_FACTOR)
+            )
+            entry.priority_score = current_priority * LOWER_POSITION_FACTOR
+        await self._write_through(entry)
         return True
 
-    def remove_from_queue(self, user_id: int) -> bool:
+    async def update_severity(self, queue_entry: QueueEntry, severity_score: float):
+        """Change a waiting entry's severity and reindex it"""
+        queue_entry.severity_score = severity_score
+        if queue_entry.status != "waiting":
+            await self.db.commit()
+            return
+        await self.ensure_index()
+        await self._write_through(queue_entry)
+
+    async def remove_from_queue(self, user_id: int) -> bool:
         """Remove user from queue"""
-        entry = self.db.query(QueueEntry).filter(
-            QueueEntry.user_id == user_id,
-            QueueEntry.status == "waiting"
-        ).first()
-        
+        await self.ensure_index()
+        entry = await self.get_waiting_entry(user_id)
         if not entry:
             return False
-        
+
         entry.status = "completed"
-        self.db.commit()
-        
-        self.update_positions()
+        await self.db.commit()
+        with _index_lock:
+            self.indexes[department_of(entry)].remove(entry.id)
+            self.wait_estimators[department_of(entry)].observe(entry.priority_level, entry.created_at,
+                                                               datetime.utcnow())
         return True
 
+    async def claim_next(self, department: Optional[str] = None,
+                         priority_level: Optional[str] = None) -> Optional[Tuple[str, IndexedEntry]]:
+        """Move the highest-priority waiting entry to in_progress for a clinician.
+
+        Looks in one department or across all of them, optionally only at
+        one level, and returns the department and entry claimed, or None
+        when nobody matches. The entry leaves the index before the write, so
+        concurrent claims in this worker never pick the same one; the write
+        only succeeds while the entry is still waiting, which keeps claims
+        exclusive across workers too.
+        """
+        await self.ensure_index()
+        departments = [department] if department is not None else list(self.indexes)
+        while True:
+            with _index_lock:
+                now = to_minutes(datetime.utcnow())
+                best = None
+                for name in departments:
+                    candidate = self.indexes[name].peek(now, priority_level)
+                    if candidate is None:
+                        continue
+                    rank = (self.indexes[name].priority(candidate.entry_id, now), -candidate.entry_id)
+                    if best is None or rank > best[0]:
+                        best = (rank, name, candidate)
+                if best is None:
+                    return None
+                _, claimed_department, claimed = best
+                self.indexes[claimed_department].remove(claimed.entry_id)
+
+            try:
+                result = await self.db.execute(
+                    update(QueueEntry).where(
+                        QueueEntry.id == claimed.entry_id,
+                        QueueEntry.status == "waiting"
+                    ).values(status="in_progress").execution_options(synchronize_session=False)
+                )
+                await self.db.commit()
+            except Exception:
+                with _index_lock:
+                    self.indexes[claimed_department].insert(claimed)
+                raise
+
+            if result.rowcount == 1:
+                with _index_lock:
+                    self.wait_estimators[claimed_department].observe(
+                        claimed.priority_level, claimed.created_at, datetime.utcnow()
+                    )
+                return claimed_department, claimed
+            # Another worker claimed or removed it before its change reached this index
+
+    async def _read_waiting(self) -> Tuple[List[IndexedEntry], List[int], List[Tuple[Optional[float], Optional[int]]]]:
+        """Every waiting entry read as columns: index entries, department numbers, stored priority and position"""
+        rows = (await self.db.execute(
+            select(
+                QueueEntry.id, QueueEntry.user_id, QueueEntry.severity_score, QueueEntry.priority_level,
+                QueueEntry.created_at, QueueEntry.priority_offset, QueueEntry.department,
+                QueueEntry.priority_score, QueueEntry.position
+            ).where(QueueEntry.status == "waiting")
+        )).all()
+        group_of = {department: group for group, department in enumerate(self.indexes)}
+        default_group = group_of[DEFAULT_DEPARTMENT]
+        entries, groups, stored = [], [], []
+        with gc_paused():
+            # Unpacking rows as tuples: attribute access per column doubles this loop
+            for entry_id, user_id, severity_score, priority_level, created_at, offset, department, priority, position \
+                    in rows:
+                entries.append(IndexedEntry(entry_id, user_id, severity_score, priority_level, created_at,
+                                            offset or 0.0))
+                groups.append(group_of.get(department, default_group))
+                stored.append((priority, position))
+        return entries, groups, stored
+
+    def _load_indexes(self, entries: List[IndexedEntry], groups: List[int], now: float):
+        """Replace every department's index contents; the caller holds _index_lock"""
+        with gc_paused():
+            for group, index in enumerate(self.indexes.values()):
+                index.load([entry for entry, entry_group in zip(entries, groups) if entry_group == group], now)
+
+    async def get_waiting_entry(self, user_id: int) -> Optional[QueueEntry]:
+        return (await self.db.execute(
+            select(QueueEntry).where(
+                QueueEntry.user_id == user_id,
+                QueueEntry.status == "waiting"
+            )
+        )).scalars().first()
+
+    async def _write_through(self, entry: QueueEntry):
+        """Commit a changed waiting entry and refresh its slot in its department's index"""
+        index = self.indexes[department_of(entry)]
+        with _index_lock:
+            previous = index.get(entry.id)
+            index.insert(_indexed(entry))
+            entry.position = index.position(entry.id)
+        try:
+            await self.db.commit()
+        except Exception:
+            with _index_lock:
+                index.remove(entry.id)
+                if previous is not None:
+                    index.insert(previous)
+            raise
+
+    def _find_user(self, user_id: int) -> Tuple[Optional[str], Optional[IndexedEntry]]:
+        """The department and index entry of a user's waiting entry"""
+        for department, index in self.indexes.items():
+            indexed = index.entry_for_user(user_id)
+            if indexed is not None:
+                return department, indexed
+        return None, None
+
+    def _department_of_entry(self, entry_id: int) -> Optional[str]:
+        for department, index in self.indexes.items():
+            if entry_id in index:
+                return department
+        return None
+
     def _calculate_priority_score(self, severity_score: float, wait_time_minutes: float) -> float:
         """Calculate priority score"""
         normalized_wait = min(wait_time_minutes / MAX_WAIT_THRESHOLD_MINUTES, 1.0)
@@ -145,8 +425,6 @@ class QueueManager:
             WAIT_WEIGHT * (normalized_wait * 10)
         )
 
-    def get_estimated_wait_time(self, position: int) -> int:
-        """Estimate wait time in minutes based on position"""
-        # Rough estimate: 15 minutes per position ahead
-        return max(0, (position - 1) * 15)
-
+    def wait_estimate(self, department: str) -> Dict:
+        """A department's learned minutes per patient, published with its queue"""
+        return self.wait_estimators[department].published()
@@ -1,80 +1,182 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from apscheduler.triggers.date import DateTrigger
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from app.models import QueueEntry, CheckInLog
-from app.queue_manager import QueueManager
-from typing import Dict, Callable
+from app.check_in_schedule import CheckInSchedule
+from typing import Dict, Callable, List, Optional
 import asyncio
+import os
+
+CHECK_IN_INTERVAL_MINUTES = float(os.getenv("CHECK_IN_INTERVAL_MINUTES", "30"))
+CHECK_IN_INTERVAL = timedelta(minutes=CHECK_IN_INTERVAL_MINUTES)
+CHECK_IN_RETRY = timedelta(minutes=float(os.getenv("CHECK_IN_RETRY_MINUTES", "5")))  # Patient not connected
+CHECK_IN_BATCH_WINDOW = timedelta(seconds=5)  # One wake also sends check-ins due this soon after
 
 scheduler = AsyncIOScheduler()
 check_in_callbacks: Dict[str, Callable] = {}  # session_id -> callback function
+check_in_owners: Dict[str, Optional[str]] = {}  # session_id -> connection that registered the callback
+check_in_schedule = CheckInSchedule()  # Next check-in deadline per waiting entry
+_armed_at: Optional[datetime] = None  # Deadline the check_in_due job is set for
+_is_leader = False  # Only the elected worker keeps the schedule and sends check-ins
 
 
-def register_check_in_callback(session_id: str, callback: Callable):
-    """Register a callback function for check-ins"""
+def register_check_in_callback(session_id: str, callback: Callable, owner: Optional[str] = None):
+    """Register a callback function for check-ins, on behalf of a connection when owner is given"""
     check_in_callbacks[session_id] = callback
+    check_in_owners[session_id] = owner
+
+
+def unregister_check_in_callback(session_id: str, owner: Optional[str] = None):
+    """Unregister a callback function, unless a connection other than owner registered it since"""
+    if session_id not in check_in_callbacks:
+        return
+    if owner is not None and check_in_owners.get(session_id) not in (None, owner):
+        return
+    del check_in_callbacks[session_id]
+    check_in_owners.pop(session_id, None)
+
+
+def schedule_check_in(entry_id: int, last_check_in: datetime):
+    """Schedule an entry's next check-in one interval after its last one (or its creation)"""
+    if _is_leader:
+        _schedule_at(entry_id, last_check_in + CHECK_IN_INTERVAL)
+
 
+def cancel_check_in(entry_id: int):
+    """Stop checking in on an entry that left the queue"""
+    check_in_schedule.cancel(entry_id)
 
-def unregister_check_in_callback(session_id: str):
-    """Unregister a callback function"""
-    if session_id in check_in_callbacks:
-        del check_in_callbacks[session_id]
 
+async def lead_check_ins(leader: bool):
+    """Take over check-ins when this worker is elected, or hand them off"""
+    from app.models import AsyncSessionLocal
+    global _is_leader
+    _is_leader = leader
+    if leader:
+        async with AsyncSessionLocal() as db:
+            await load_check_ins(db)
+    else:
+        check_in_schedule.clear()
+        _arm_check_in_job()
 
-async def periodic_check_in_task(db: Session):
-    """Check in with users every 30 minutes"""
+
+async def load_check_ins(db: AsyncSession):
+    """Rebuild the check-in schedule from the waiting entries in the database"""
+    rows = (await db.execute(
+        select(QueueEntry.id, QueueEntry.created_at, QueueEntry.last_check_in).where(
+            QueueEntry.status == "waiting"
+        )
+    )).all()
+    check_in_schedule.clear()
+    for entry_id, created_at, last_check_in in rows:
+        check_in_schedule.schedule(entry_id, (last_check_in or created_at) + CHECK_IN_INTERVAL)
+    _arm_check_in_job()
+
+
+async def send_due_check_ins(db: AsyncSession, entry_ids: List[int]):
+    """Send check-ins for due entries concurrently and record them in one commit"""
     current_time = datetime.utcnow()
-    check_in_interval = timedelta(minutes=30)
-    
-    # Get all active queue entries
-    queue_entries = db.query(QueueEntry).filter(
-        QueueEntry.status == "waiting"
-    ).all()
-    
+    queue_entries = (await db.execute(
+        select(QueueEntry).options(selectinload(QueueEntry.user)).where(
+            QueueEntry.id.in_(entry_ids),
+            QueueEntry.status == "waiting"  # Entries that left the queue are dropped
+        )
+    )).scalars().all()
+
+    sends = []
     for entry in queue_entries:
-        # Check if it's time for a check-in
-        last_check_in = entry.last_check_in or entry.created_at
-        time_since_check_in = current_time - last_check_in
-        
-        if time_since_check_in >= check_in_interval:
-            # Send check-in notification via WebSocket
-            user = entry.user
-            if user and user.session_id in check_in_callbacks:
-                callback = check_in_callbacks[user.session_id]
-                try:
-                    await callback({
-                        "type": "check_in",
-                        "user_id": user.id,
-                        "queue_entry_id": entry.id,
-                        "message": "How are you feeling? Please let us know if your condition has changed."
-                    })
-                    # Update last check-in time
-                    entry.last_check_in = current_time
-                    db.commit()
-                except Exception as e:
-                    print(f"Error sending check-in to {user.session_id}: {e}")
+        user = entry.user
+        callback = check_in_callbacks.get(user.session_id) if user else None
+        if callback is None:
+            # Not connected; try again once they may be back
+            _schedule_at(entry.id, current_time + CHECK_IN_RETRY)
+            continue
+        sends.append((entry, callback({
+            "type": "check_in",
+            "user_id": user.id,
+            "queue_entry_id": entry.id,
+            "message": "How are you feeling? Please let us know if your condition has changed."
+        })))
+
+    results = await asyncio.gather(*(send for _, send in sends), return_exceptions=True)
+    for (entry, _), result in zip(sends, results):
+        if isinstance(result, Exception):
+            print(f"Error sending check-in to {entry.user.session_id}: {result}")
+            _schedule_at(entry.id, current_time + CHECK_IN_RETRY)
+            continue
+        entry.last_check_in = current_time
+        _schedule_at(entry.id, current_time + CHECK_IN_INTERVAL)
+
+    if sends:
+        await db.commit()
+
+
+async def _run_due_check_ins():
+    """Scheduler job fired at the earliest check-in deadline"""
+    from app.models import AsyncSessionLocal
+    global _armed_at
+    _armed_at = None
+    entry_ids = check_in_schedule.pop_due(datetime.utcnow() + CHECK_IN_BATCH_WINDOW)
+    try:
+        if entry_ids:
+            async with AsyncSessionLocal() as db:
+                await send_due_check_ins(db, entry_ids)
+    except Exception as e:
+        print(f"Error running check-ins: {e}")
+    finally:
+        _arm_check_in_job()
+
+
+def _schedule_at(entry_id: int, due_at: datetime):
+    check_in_schedule.schedule(entry_id, due_at)
+    if _armed_at is None or due_at < _armed_at:
+        _arm_check_in_job()
+
+
+def _arm_check_in_job():
+    """Point the single check-in job at the earliest deadline"""
+    global _armed_at
+    next_due = check_in_schedule.next_due() if _is_leader else None
+    if next_due is None:
+        _armed_at = None
+        if scheduler.get_job("check_in_due"):
+            scheduler.remove_job("check_in_due")
+        return
+    _armed_at = next_due
+    scheduler.add_job(
+        _run_due_check_ins,
+        DateTrigger(run_date=next_due, timezone=timezone.utc),
+        id="check_in_due",
+        replace_existing=True,
+        misfire_grace_time=None  # Overdue deadlines (e.g. after a restart) still run
+    )
 
 
 def start_scheduler():
-    """Start the periodic check-in scheduler"""
-    from app.models import SessionLocal
+    """Start the scheduler; check-in jobs are armed once this worker leads"""
     if not scheduler.running:
-        async def job_wrapper():
-            db = SessionLocal()
-            try:
-                await periodic_check_in_task(db)
-            finally:
-                db.close()
-        
-        scheduler.add_job(
-            job_wrapper,
-            IntervalTrigger(minutes=30),
-            id="periodic_check_in",
-            replace_existing=True
-        )
         scheduler.start()
-        print("Scheduler started - periodic check-ins every 30 minutes")
+        print(f"Scheduler started - check-ins every {CHECK_IN_INTERVAL_MINUTES} minutes per patient")
+
+
+def schedule_queue_reorder(department: str, run_at: Optional[datetime], callback: Callable):
+    """Run callback(department) once at the department's next aging crossover (naive UTC),
+    replacing any pending run"""
+    job_id = f"queue_reorder:{department}"
+    if run_at is None:
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+        return
+    scheduler.add_job(
+        callback,
+        DateTrigger(run_date=run_at, timezone=timezone.utc),
+        args=[department],
+        id=job_id,
+        replace_existing=True
+    )
 
 
 def stop_scheduler():
@@ -0,0 +1,56 @@
+"""
+Single-flight coalescing of concurrent duplicate requests
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from app.cache import LRUCache
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result.
+
+    Results of calls made with a replay_key are also kept for replay_ttl_seconds,
+    so a client retrying with the same request key after the first call
+    finished gets the original response instead of repeating the work.
+    """
+
+    def __init__(self, replay_ttl_seconds: float = 300, max_replays: int = 1024):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._replays = LRUCache(max_replays, replay_ttl_seconds)
+        self.started = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                 replay_key: Optional[Hashable] = None) -> Any:
+        if replay_key is not None:
+            found, result = self._replays.get(replay_key, (False, None))
+            if found:
+                self.replayed += 1
+                return result
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.started += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done, replay_key))
+        # Shield so one caller disconnecting does not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._inflight),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+        }
+
+    def _finish(self, key: Hashable, task: asyncio.Future, replay_key: Optional[Hashable]):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if replay_key is not None and not task.cancelled() and task.exception() is None:
+            self._replays.put(replay_key, (True, task.result()))
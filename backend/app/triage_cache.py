@@ -0,0 +1,48 @@
+"""
+Content-addressed cache of triage analysis results.
+
+Keys hash the normalized conversation plus the user history fields that
+feed the analysis prompt, so a retried or duplicated complete-triage
+request with the same transcript skips the LLM call.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+from app.cache import LRUCache
+
+TRIAGE_CACHE_MAX = int(os.getenv("TRIAGE_CACHE_MAX", "1024"))
+TRIAGE_CACHE_TTL_SECONDS = float(os.getenv("TRIAGE_CACHE_TTL_SECONDS", "600"))
+# Also reuse the result stored on ConversationHistory when its key matches
+TRIAGE_CACHE_PERSIST = os.getenv("TRIAGE_CACHE_PERSIST", "true").lower() == "true"
+
+
+class TriageCache:
+    def __init__(self, max_entries: int = TRIAGE_CACHE_MAX, ttl_seconds: float = TRIAGE_CACHE_TTL_SECONDS):
+        self._cache = LRUCache(max_entries, ttl_seconds)
+
+    @staticmethod
+    def key(messages: List[Dict], user_history: Optional[Dict] = None) -> str:
+        """Stable hash of the normalized transcript and relevant history"""
+        user_history = user_history or {}
+        payload = {
+            "messages": [
+                [msg.get("role", "user"), " ".join((msg.get("content") or "").split())]
+                for msg in messages
+            ],
+            "misuse_count": user_history.get("misuse_count", 0),
+            "previous_severities": sorted(user_history.get("previous_severities") or []),
+        }
+        encoded = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        result = self._cache.get(key)
+        return dict(result) if result is not None else None
+
+    def put(self, key: str, result: Dict):
+        self._cache.put(key, dict(result))
+
+    def stats(self) -> Dict:
+        return self._cache.stats()
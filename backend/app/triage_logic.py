@@ -9,6 +9,10 @@ SEVERITY_LEVELS = {
     "Low": (1, 3)         # Self-care guidance
 }
 
+# Separate queues, each with its own ordering and subscribers
+DEPARTMENTS = ("emergency", "urgent_care")
+DEFAULT_DEPARTMENT = "urgent_care"
+
 EMERGENCY_KEYWORDS = [
     "chest pain", "difficulty breathing", "can't breathe", "choking",
     "severe pain", "unconscious", "severe bleeding", "heart attack",
@@ -40,6 +44,13 @@ def is_emergency(text: str, severity_score: float) -> bool:
     return False
 
 
+def get_department(severity_score: float, emergency: bool) -> str:
+    """Pick the queue a triaged patient waits in"""
+    if emergency or get_severity_level(severity_score) == "Critical":
+        return "emergency"
+    return DEFAULT_DEPARTMENT
+
+
 def get_care_recommendation(severity_level: str) -> str:
     """Get care recommendation based on severity level"""
     recommendations = {
@@ -0,0 +1,74 @@
+"""
+Online wait estimates learned from how fast a department's queue moves.
+
+Every patient leaving the waiting queue is a sample: the minutes since the
+previous departure, or since the patient joined if the queue was empty
+until then. With several clinicians the gaps shrink accordingly, so the
+samples track throughput rather than consultation length. Gaps are
+smoothed with an EWMA, overall and per severity level, so estimates follow
+a change in staffing within a few patients.
+
+A patient's estimated wait is the sum of the smoothed gaps of the patients
+ahead. The sums are prefix totals built once per queue snapshot, which
+makes each lookup O(1). Levels without samples use the overall gap, and
+before any sample arrives the overall gap is WAIT_ESTIMATE_PRIOR_MINUTES.
+"""
+
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app.priority_index import QueueSnapshot
+
+WAIT_ESTIMATE_PRIOR_MINUTES = float(os.getenv("WAIT_ESTIMATE_PRIOR_MINUTES", "15"))
+WAIT_ESTIMATE_ALPHA = float(os.getenv("WAIT_ESTIMATE_ALPHA", "0.2"))  # Weight of the newest sample
+# Longer gaps mean nobody was being seen (closed, shift change), not slow service
+WAIT_ESTIMATE_MAX_GAP_MINUTES = float(os.getenv("WAIT_ESTIMATE_MAX_GAP_MINUTES", "120"))
+
+
+class WaitEstimator:
+    def __init__(self, prior_minutes: float = WAIT_ESTIMATE_PRIOR_MINUTES, alpha: float = WAIT_ESTIMATE_ALPHA,
+                 max_gap_minutes: float = WAIT_ESTIMATE_MAX_GAP_MINUTES):
+        self.alpha = alpha
+        self.max_gap_minutes = max_gap_minutes
+        self.minutes_per_patient = prior_minutes
+        self.level_minutes: Dict[str, float] = {}
+        self.samples = 0
+        self.revision = 0  # Bumped on every sample; prefix totals from older revisions are stale
+        self._last_departure: Optional[datetime] = None
+        self._totals_for: Optional[Tuple[QueueSnapshot, int]] = None
+        self._totals: List[float] = []
+
+    def observe(self, priority_level: str, joined_at: datetime, left_at: datetime):
+        """Learn from one patient leaving the waiting queue"""
+        start = joined_at if self._last_departure is None else max(joined_at, self._last_departure)
+        if self._last_departure is None or left_at > self._last_departure:
+            self._last_departure = left_at
+        gap = (left_at - start).total_seconds() / 60
+        if gap < 0 or gap > self.max_gap_minutes:
+            return
+
+        level_minutes = self.level_minutes.get(priority_level, self.minutes_per_patient)
+        self.level_minutes[priority_level] = level_minutes + self.alpha * (gap - level_minutes)
+        self.minutes_per_patient += self.alpha * (gap - self.minutes_per_patient)
+        self.samples += 1
+        self.revision += 1
+
+    def wait_minutes(self, snapshot: QueueSnapshot, position: int) -> int:
+        """Wait in minutes for the patient at a position in the snapshot, from the levels of those ahead"""
+        if self._totals_for is None or self._totals_for[0] is not snapshot or self._totals_for[1] != self.revision:
+            totals = [0.0]
+            for entry in snapshot.entries:
+                totals.append(totals[-1] + self.level_minutes.get(entry.priority_level, self.minutes_per_patient))
+            self._totals = totals
+            self._totals_for = (snapshot, self.revision)
+        return max(0, round(self._totals[position - 1]))
+
+    def published(self) -> Dict:
+        """What clients need to estimate waits themselves"""
+        return {
+            "minutes_per_patient": round(self.minutes_per_patient, 2),
+            "minutes_by_level": {level: round(minutes, 2) for level, minutes in self.level_minutes.items()},
+        }
+
+    def stats(self) -> Dict:
+        return dict(self.published(), samples=self.samples)
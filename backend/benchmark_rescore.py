@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the full queue rescore.
+
+Fills a throwaway SQLite file with waiting entries, then times
+QueueManager.update_positions against the same method as it was before
+the batch rescore, and checks that the stored positions agree with the
+stored priorities after each.
+
+The baseline is the real pre-change code: the app package at
+--baseline-ref is exported from git into the scratch directory and run in
+a subprocess against the same database, so this needs a git checkout.
+
+Run this from the backend directory:
+    python benchmark_rescore.py --entries 50000
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_REF = "a5169a4^"  # Last commit before update_positions was batched
+
+# Runs in the exported baseline package; prints each run's seconds as JSON
+BASELINE_SCRIPT = """
+import asyncio, json, time
+from app.models import AsyncSessionLocal, async_engine
+from app.queue_manager import QueueManager
+
+async def main():
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        await QueueManager(db).update_positions()
+        elapsed = time.perf_counter() - started
+    await async_engine.dispose()
+    print(json.dumps(elapsed))
+
+asyncio.run(main())
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the full queue rescore")
+    parser.add_argument("--entries", type=int, default=50000, help="Waiting entries to rescore")
+    parser.add_argument("--runs", type=int, default=3, help="Runs of each version; the best is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline-ref", default=BASELINE_REF, help="Git revision of the per-object baseline")
+    return parser.parse_args()
+
+
+def export_baseline(ref: str, target_dir: str):
+    """Write the backend's app package as it was at ref into target_dir/app"""
+    def git(*args) -> bytes:
+        return subprocess.run(["git", *args], cwd=BACKEND_DIR, check=True, capture_output=True).stdout
+
+    top_level = git("rev-parse", "--show-toplevel").decode().strip()
+    prefix = git("rev-parse", "--show-prefix").decode().strip()
+    archive = subprocess.run(
+        ["git", "archive", f"{ref}:{prefix}app"], cwd=top_level, check=True, capture_output=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(os.path.join(target_dir, "app"))
+
+
+def run_baseline(baseline_dir: str) -> float:
+    """Seconds one pre-change update_positions takes on the benchmark database"""
+    result = subprocess.run(
+        [sys.executable, "-c", BASELINE_SCRIPT], cwd=baseline_dir, check=True, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=baseline_dir)
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def seed_entries(engine, count: int, seed: int):
+    from sqlalchemy import insert
+    from app.models import QueueEntry
+    from app.triage_logic import DEPARTMENTS, get_severity_level
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    rows = []
+    for i in range(count):
+        severity = rng.randint(1, 10)
+        rows.append({
+            "user_id": i + 1,
+            "severity_score": severity,
+            "priority_score": 0.0,
+            "priority_level": get_severity_level(severity),
+            "priority_offset": rng.choice([0.0, 0.0, 0.0, rng.uniform(0, 2)]),
+            "position": 0,
+            "status": "waiting",
+            "department": rng.choice(DEPARTMENTS),
+            "created_at": now - timedelta(minutes=rng.uniform(0, 240)),
+        })
+    with engine.begin() as connection:
+        connection.execute(insert(QueueEntry), rows)
+
+
+async def stored_scores(db):
+    """(id, priority, position) of every waiting entry as stored"""
+    from sqlalchemy import select
+    from app.models import QueueEntry
+
+    return set((await db.execute(select(
+        QueueEntry.id, QueueEntry.priority_score, QueueEntry.position
+    ).where(QueueEntry.status == "waiting"))).all())
+
+
+async def misplaced_entries(db) -> int:
+    """Entries whose stored position disagrees with the stored priorities"""
+    from sqlalchemy import select
+    from app.models import QueueEntry
+
+    rows = (await db.execute(select(
+        QueueEntry.id, QueueEntry.department, QueueEntry.priority_score, QueueEntry.position
+    ).where(QueueEntry.status == "waiting"))).all()
+    misplaced = 0
+    counts = {}
+    for entry_id, department, _, position in sorted(rows, key=lambda row: (row[1], -row[2], row[0])):
+        counts[department] = counts.get(department, 0) + 1
+        misplaced += position != counts[department]
+    return misplaced
+
+
+async def run(args, baseline_dir: str):
+    from app.models import AsyncSessionLocal, async_engine, engine, init_db
+    from app.queue_manager import QueueManager
+    from app import rescoring
+
+    init_db()
+    seed_entries(engine, args.entries, args.seed)
+    engine.dispose()
+
+    legacy_best, batch_best, batch_written = None, None, 0
+    for _ in range(args.runs):
+        elapsed = run_baseline(baseline_dir)
+        legacy_best = elapsed if legacy_best is None else min(legacy_best, elapsed)
+        async with AsyncSessionLocal() as db:
+            legacy_misplaced = await misplaced_entries(db)
+
+            before = await stored_scores(db)
+            await db.commit()
+            started = time.perf_counter()
+            await QueueManager(db).update_positions()
+            elapsed = time.perf_counter() - started
+            if batch_best is None or elapsed < batch_best:
+                batch_best, batch_written = elapsed, len(await stored_scores(db) - before)
+            batch_misplaced = await misplaced_entries(db)
+
+    await async_engine.dispose()
+
+    print(f"Entries: {args.entries}  numpy: {'yes' if rescoring.np is not None else 'no'}")
+    print(f"Per-object rescore ({args.baseline_ref}): {legacy_best * 1000:8.0f} ms")
+    print(f"Batch rescore: {batch_best * 1000:8.0f} ms  ({legacy_best / batch_best:.1f}x faster, "
+          f"{batch_written} of {args.entries} rows written)")
+    print(f"Misplaced entries: per-object {legacy_misplaced}, batch {batch_misplaced}")
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="mediqueue-rescore-") as tmp_dir:
+        baseline_dir = os.path.join(tmp_dir, "baseline")
+        export_baseline(args.baseline_ref, baseline_dir)
+        os.environ["DATABASE_PATH"] = os.path.join(tmp_dir, "benchmark.db")
+        sys.path.insert(0, BACKEND_DIR)
+        asyncio.run(run(args, baseline_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark for the triage flow.
+
+Starts the API in-process on the offline stub LLM with a throwaway SQLite
+file, then drives simulated patients through start-triage, several
+message turns, complete-triage and a check-in response while each holds a
+WebSocket subscription. Reports throughput, per-endpoint latency
+percentiles, broadcast fan-out time and SQLite write counts, and saves
+them as JSON.
+
+Run this from the backend directory:
+    python benchmark_triage.py --patients 200 --window 600 --time-scale 10 --output benchmarks/baseline.json
+    python benchmark_triage.py --compare benchmarks/baseline.json
+
+Results go to the temp directory unless --output says otherwise;
+benchmarks/ is ignored by git.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(tempfile.gettempdir(), "mediqueue-benchmark-triage.json")  # Outside the source tree
+STAFF_TOKEN = "benchmark-staff-token"
+CHECK_IN_RESPONSES = ["better", "same", "worse"]
+SYMPTOMS = [
+    "I have had a headache since this morning",
+    "My ankle is swollen after I twisted it",
+    "I have a fever and a sore throat",
+    "I feel dizzy and a bit nauseous",
+    "I have chest pain when I breathe deeply",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the MediQueue triage flow")
+    parser.add_argument("--patients", type=int, default=200, help="Number of simulated patients")
+    parser.add_argument("--window", type=float, default=600, help="Arrival window in simulated seconds")
+    parser.add_argument("--time-scale", type=float, default=10,
+                        help="Simulated seconds per real second for arrivals (10 runs a 10 minute window in 1 minute)")
+    parser.add_argument("--turns", type=int, default=3, help="Message turns per patient")
+    parser.add_argument("--stream", action="store_true", help="Request streamed replies over the WebSocket")
+    parser.add_argument("--staff-subscribers", type=int, default=2,
+                        help="WebSockets subscribed to each department's full queue; patients get their own view")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="Stub LLM median latency")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.4, help="Stub LLM log-normal spread")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for arrivals and responses")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative p95 increase before --compare reports a regression")
+    return parser.parse_args()
+
+
+def configure_environment(args, db_file: str):
+    """Must run before the app is imported, since modules read settings at import time"""
+    os.environ["LLM_BACKEND"] = "stub"
+    os.environ["LLM_STUB_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["LLM_STUB_LATENCY_SIGMA"] = str(args.llm_latency_sigma)
+    os.environ["LLM_STUB_SEED"] = str(args.seed)
+    os.environ["DATABASE_PATH"] = db_file
+    os.environ["STAFF_API_TOKEN"] = STAFF_TOKEN
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def count_sqlite_writes(engine) -> Counter:
+    """Count INSERT/UPDATE/DELETE statements and commits issued through the engine"""
+    from sqlalchemy import event
+
+    counts = Counter()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if verb in ("INSERT", "UPDATE", "DELETE"):
+            counts[verb] += 1
+
+    @event.listens_for(engine, "commit")
+    def commit(conn):
+        counts["commits"] += 1
+
+    return counts
+
+
+def start_server(port: int):
+    import uvicorn
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    # Signal handlers can only be installed from the main thread
+    server.install_signal_handlers = lambda: None
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def percentiles(samples: List[float]) -> Dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 2),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.triage_sent_at: Dict[int, float] = {}  # queue_entry_id -> time complete-triage was sent
+        # queue_entry_id -> (socket connected at, first arrival) per socket
+        self.first_seen: Dict[int, List[tuple]] = defaultdict(list)
+        self.ws_messages = 0
+        self.ws_bytes = 0
+
+    async def call(self, client, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except Exception:
+            self.errors[path] += 1
+            return None
+        self.latencies[path].append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.errors[path] += 1
+            return None
+        return response.json()
+
+
+async def subscribe(ws_url: str, recorder: Recorder, stop: asyncio.Event, ready: asyncio.Event):
+    """Hold a WebSocket open and note when each queue entry first appears"""
+    import websockets
+
+    seen = set()
+    async with websockets.connect(ws_url, max_size=None) as websocket:
+        connected_at = time.perf_counter()
+        ready.set()
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(websocket.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            except Exception:
+                return
+            received = time.perf_counter()
+            recorder.ws_messages += 1
+            recorder.ws_bytes += len(raw)
+            message = json.loads(raw)
+            if message.get("type") == "queue_snapshot":
+                entries = message["queue"]
+            elif message.get("type") == "queue_delta":
+                entries = message["inserted"]
+            elif message.get("type") == "queue_position":
+                entries = [message] if message.get("queue_entry_id") else []
+            else:
+                continue
+            for entry in entries:
+                entry_id = entry.get("queue_entry_id")
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    recorder.first_seen[entry_id].append((connected_at, received))
+
+
+async def patient(client, base_ws: str, recorder: Recorder, rng: random.Random, args,
+                  stop: asyncio.Event, subscriptions: List[asyncio.Task]):
+    started = await recorder.call(client, "POST", "/api/start-triage", json={"name": "Benchmark patient"})
+    if not started:
+        return False
+    session_id = started["session_id"]
+
+    ready = asyncio.Event()
+    subscriptions.append(asyncio.create_task(
+        subscribe(f"{base_ws}/ws/{session_id}", recorder, stop, ready)
+    ))
+    await asyncio.wait_for(ready.wait(), timeout=10)
+
+    for turn in range(args.turns):
+        content = rng.choice(SYMPTOMS) if turn == 0 else f"It started about {rng.randint(1, 12)} hours ago"
+        await recorder.call(client, "POST", "/api/message", json={
+            "session_id": session_id, "content": content, "stream": args.stream
+        })
+
+    sent_at = time.perf_counter()
+    result = await recorder.call(client, "POST", "/api/complete-triage", json={"session_id": session_id})
+    if not result:
+        return False
+
+    entry = await recorder.call(client, "GET", "/api/queue/me", params={"session_id": session_id})
+    if not entry or entry["queue_entry_id"] is None:
+        return True
+    recorder.triage_sent_at[entry["queue_entry_id"]] = sent_at
+    await recorder.call(client, "POST", "/api/check-in-response", json={
+        "session_id": session_id,
+        "queue_entry_id": entry["queue_entry_id"],
+        "response": rng.choice(CHECK_IN_RESPONSES)
+    })
+    return True
+
+
+async def run_load(args, recorder: Recorder) -> Dict:
+    import httpx
+    from app.triage_logic import DEPARTMENTS
+
+    rng = random.Random(args.seed)
+    base_url = f"http://127.0.0.1:{args.port}"
+    stop = asyncio.Event()
+    subscriptions: List[asyncio.Task] = []
+
+    # Poisson arrivals over the window, compressed by the time scale
+    rate = args.patients / args.window
+    arrivals, now = [], 0.0
+    for _ in range(args.patients):
+        now += rng.expovariate(rate)
+        arrivals.append(now / args.time_scale)
+
+    limits = httpx.Limits(max_connections=args.patients, max_keepalive_connections=args.patients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        base_ws = base_url.replace("http", "ws")
+        for department in DEPARTMENTS:
+            for i in range(args.staff_subscribers):
+                ready = asyncio.Event()
+                subscriptions.append(asyncio.create_task(subscribe(
+                    f"{base_ws}/ws/staff-{department}-{i}?view=full&department={department}&token={STAFF_TOKEN}",
+                    recorder, stop, ready
+                )))
+                await asyncio.wait_for(ready.wait(), timeout=10)
+
+        started = time.perf_counter()
+
+        async def arrive(delay: float, patient_rng: random.Random):
+            await asyncio.sleep(delay)
+            return await patient(client, base_ws, recorder, patient_rng, args,
+                                 stop, subscriptions)
+
+        outcomes = await asyncio.gather(*[
+            arrive(delay, random.Random(rng.random())) for delay in arrivals
+        ], return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+        # Give the last broadcasts time to land before closing sockets
+        await asyncio.sleep(1)
+        stop.set()
+        await asyncio.gather(*subscriptions, return_exceptions=True)
+
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "patients_completed": sum(1 for outcome in outcomes if outcome is True),
+        "patient_failures": sum(1 for outcome in outcomes if outcome is not True),
+    }
+
+
+def fanout_samples(recorder: Recorder) -> List[float]:
+    """Per entry: time from sending complete-triage until the last already-connected socket saw it"""
+    samples = []
+    for entry_id, sent_at in recorder.triage_sent_at.items():
+        arrivals = [received for connected_at, received in recorder.first_seen.get(entry_id, [])
+                    if connected_at < sent_at]
+        if arrivals:
+            samples.append((max(arrivals) - sent_at) * 1000)
+    return samples
+
+
+def compare(results: Dict, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    ok = True
+    print(f"\nComparison with {baseline_path} (tolerance {tolerance:.0%} on p95)")
+    rows = [(name, stats, baseline["endpoints"].get(name, {})) for name, stats in results["endpoints"].items()]
+    rows.append(("broadcast fan-out", results["broadcast_fanout"], baseline.get("broadcast_fanout", {})))
+    for name, current, previous in rows:
+        if not previous.get("p95_ms") or not current.get("p95_ms"):
+            continue
+        change = current["p95_ms"] / previous["p95_ms"] - 1
+        flag = "REGRESSION" if change > tolerance else ""
+        ok = ok and not flag
+        print(f"  {name:28s} p95 {previous['p95_ms']:>9.1f} -> {current['p95_ms']:>9.1f} ms ({change:+.0%}) {flag}")
+    previous_writes = baseline.get("sqlite_writes", {}).get("total")
+    if previous_writes:
+        print(f"  {'sqlite writes':28s} {previous_writes:>13} -> {results['sqlite_writes']['total']:>9}")
+    return ok
+
+
+def print_report(results: Dict):
+    print("\n" + "=" * 80)
+    print("TRIAGE FLOW BENCHMARK")
+    print("=" * 80)
+    run = results["run"]
+    print(f"Patients completed: {run['patients_completed']} ({run['patient_failures']} failed) "
+          f"in {run['elapsed_seconds']}s")
+    print(f"Throughput: {results['throughput_rps']} requests/s, "
+          f"{results['patients_per_second']} patients/s")
+    print(f"\n{'endpoint':28s} {'count':>6} {'errors':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, stats in results["endpoints"].items():
+        print(f"{name:28s} {stats['count']:>6} {stats['errors']:>6} "
+              f"{stats.get('p50_ms', 0):>9.1f} {stats.get('p95_ms', 0):>9.1f} {stats.get('p99_ms', 0):>9.1f}")
+    fanout = results["broadcast_fanout"]
+    if fanout["count"]:
+        print(f"{'broadcast fan-out':28s} {fanout['count']:>6} {'':>6} "
+              f"{fanout['p50_ms']:>9.1f} {fanout['p95_ms']:>9.1f} {fanout['p99_ms']:>9.1f}")
+    websocket = results["websocket"]
+    print(f"\nWebSocket: {websocket['bytes'] / 1024:.1f} KiB received in {websocket['messages']} messages")
+    writes = results["sqlite_writes"]
+    print(f"\nSQLite: {writes['total']} write statements ({writes['INSERT']} INSERT, {writes['UPDATE']} UPDATE, "
+          f"{writes['DELETE']} DELETE), {writes['commits']} commits")
+
+
+def main():
+    args = parse_args()
+    db_dir = tempfile.mkdtemp(prefix="mediqueue-bench-")
+    configure_environment(args, os.path.join(db_dir, "benchmark.db"))
+
+    from app.models import async_engine
+    writes = count_sqlite_writes(async_engine.sync_engine)  # The engine behind the API's async sessions
+    server, thread = start_server(args.port)
+
+    recorder = Recorder()
+    try:
+        run = asyncio.run(run_load(args, recorder))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    total_requests = sum(len(samples) for samples in recorder.latencies.values())
+    results = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "run": run,
+        "throughput_rps": round(total_requests / run["elapsed_seconds"], 2),
+        "patients_per_second": round(run["patients_completed"] / run["elapsed_seconds"], 3),
+        "endpoints": {
+            name: dict(percentiles(samples), errors=recorder.errors[name])
+            for name, samples in sorted(recorder.latencies.items())
+        },
+        "broadcast_fanout": percentiles(fanout_samples(recorder)),
+        "websocket": {"messages": recorder.ws_messages, "bytes": recorder.ws_bytes},
+        "sqlite_writes": {
+            "INSERT": writes["INSERT"],
+            "UPDATE": writes["UPDATE"],
+            "DELETE": writes["DELETE"],
+            "total": writes["INSERT"] + writes["UPDATE"] + writes["DELETE"],
+            "commits": writes["commits"],
+        },
+    }
+
+    print_report(results)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
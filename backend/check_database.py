@@ -4,6 +4,7 @@ Script to check database contents
 Run this from the backend directory: python check_database.py
 """
 
+import asyncio
 import sys
 import os
 from datetime import datetime
@@ -11,7 +12,8 @@ from datetime import datetime
 # Add the app directory to the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
 
-from app.models import SessionLocal, User, QueueEntry, ConversationHistory, CheckInLog
+from app.models import SessionLocal, AsyncSessionLocal, async_engine, User, QueueEntry, ConversationHistory, CheckInLog
+from app.conversation_store import ConversationStore
 
 def format_datetime(dt):
     """Format datetime for display"""
@@ -65,9 +67,20 @@ def print_queue_entries(db):
         print(f"  Created At: {format_datetime(entry.created_at)}")
         print(f"  Last Check-in: {format_datetime(entry.last_check_in)}")
 
+async def read_conversations(user_ids):
+    """Message count and first 3 messages per user, read through the async ConversationStore"""
+    conversations = {}
+    async with AsyncSessionLocal() as session:
+        store = ConversationStore(session)
+        for user_id in user_ids:
+            conversations[user_id] = (await store.count_messages(user_id), await store.get_messages(user_id, limit=3))
+    await async_engine.dispose()
+    return conversations
+
 def print_conversation_histories(db):
     """Print all conversation histories"""
     histories = db.query(ConversationHistory).order_by(ConversationHistory.timestamp.desc()).all()
+    conversations = asyncio.run(read_conversations({history.user_id for history in histories}))
     print("\n" + "="*80)
     print("CONVERSATION HISTORIES TABLE")
     print("="*80)
@@ -82,16 +95,17 @@ def print_conversation_histories(db):
             print(f"  User Session ID: {history.user.session_id}")
             print(f"  User Name: {history.user.name or 'Not provided'}")
         print(f"  Timestamp: {format_datetime(history.timestamp)}")
-        print(f"  Number of Messages: {len(history.messages) if history.messages else 0}")
+        message_count, first_messages = conversations[history.user_id]
+        print(f"  Number of Messages: {message_count}")
         
-        if history.messages:
+        if message_count:
             print(f"  Messages:")
-            for i, msg in enumerate(history.messages[:3], 1):  # Show first 3 messages
-                role = msg.get('role', 'unknown')
-                content = msg.get('content', '')[:100]  # First 100 chars
+            for i, msg in enumerate(first_messages, 1):  # Show first 3 messages
+                role = msg.get('role') or 'unknown'
+                content = (msg.get('content') or '')[:100]  # First 100 chars
                 print(f"    {i}. [{role}]: {content}...")
-            if len(history.messages) > 3:
-                print(f"    ... and {len(history.messages) - 3} more messages")
+            if message_count > 3:
+                print(f"    ... and {message_count - 3} more messages")
         
         if history.triage_result:
             print(f"  Triage Result:")
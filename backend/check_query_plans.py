@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check for the hot queries.
+
+Builds a throwaway database with the current schema, runs EXPLAIN QUERY
+PLAN for every query the API issues per request or per scheduler tick,
+and fails if any of them scans a whole table or sorts in a temporary
+B-tree instead of reading an index in order.
+
+Run this from the backend directory:
+    python check_query_plans.py
+    python check_query_plans.py --verbose
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def hot_queries():
+    """(name, statement) pairs mirroring the queries in app/"""
+    from sqlalchemy import select
+    from app.models import User, QueueEntry, ConversationHistory, ConversationMessage
+
+    return [
+        ("user by session (main.get_user)",
+         select(User).where(User.session_id == "session")),
+        ("latest history (main.get_latest_history)",
+         select(ConversationHistory).where(
+             ConversationHistory.user_id == 1
+         ).order_by(ConversationHistory.timestamp.desc()).limit(1)),
+        ("waiting entries (QueueManager.ensure_index, scheduler)",
+         select(QueueEntry).where(QueueEntry.status == "waiting")),
+        ("waiting queue in order",
+         select(QueueEntry).where(QueueEntry.status == "waiting").order_by(QueueEntry.position)),
+        ("user's waiting entry (QueueManager.get_waiting_entry)",
+         select(QueueEntry).where(QueueEntry.user_id == 1, QueueEntry.status == "waiting")),
+        ("previous entries (main.complete_triage)",
+         select(QueueEntry).where(QueueEntry.user_id == 1, QueueEntry.status != "waiting")),
+        ("check-in entry (main.check_in_response)",
+         select(QueueEntry).where(QueueEntry.id == 1, QueueEntry.user_id == 1)),
+        ("messages in order (ConversationStore.get_messages)",
+         select(ConversationMessage.role, ConversationMessage.content).where(
+             ConversationMessage.user_id == 1
+         ).order_by(ConversationMessage.sequence)),
+        ("messages since (ConversationStore.get_messages_since)",
+         select(ConversationMessage.role, ConversationMessage.content).where(
+             ConversationMessage.user_id == 1, ConversationMessage.sequence > 3
+         ).order_by(ConversationMessage.sequence)),
+        ("last sequence (ConversationStore.last_sequence)",
+         select(ConversationMessage.sequence).where(
+             ConversationMessage.user_id == 1
+         ).order_by(ConversationMessage.sequence.desc()).limit(1)),
+    ]
+
+
+def plan_problems(plan_rows) -> list:
+    """Plan steps that read a whole table or sort outside an index"""
+    problems = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith("SCAN") and "CONSTANT ROW" not in detail:
+            problems.append(detail)
+        elif detail.startswith("USE TEMP B-TREE"):
+            problems.append(detail)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a hot query does a full scan")
+    parser.add_argument("--verbose", action="store_true", help="Print every query plan")
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="mediqueue-plans-")
+    os.environ["DATABASE_PATH"] = os.path.join(db_dir, "plans.db")
+    sys.path.insert(0, BACKEND_DIR)
+
+    from app.models import engine, init_db
+
+    init_db()
+    failures = 0
+    with engine.connect() as connection:
+        for name, statement in hot_queries():
+            sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            problems = plan_problems(plan)
+            status = "FAIL" if problems else "ok"
+            print(f"[{status}] {name}")
+            if args.verbose or problems:
+                for row in plan:
+                    print(f"         {row[-1]}")
+            failures += bool(problems)
+    engine.dispose()
+
+    if failures:
+        print(f"\n{failures} hot queries are not served by an index")
+        sys.exit(1)
+    print("\nAll hot queries use an index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Offline discrete-event simulator for the waiting queue.
+
+Replays an arrival stream through the same PriorityIndex the API uses and
+the same level and department rules from triage_logic. Clinicians in each
+department always take the highest-priority waiting patient. Waiting
+patients check in on the scheduler's interval, and a "worse" answer raises
+their severity by one, just as the check-in endpoint does. Simulated days
+run in seconds, so weights can be compared before production changes.
+
+Arrivals come from a Poisson stream with a severity mix, or from a CSV
+file with an arrival_minutes or created_at column, a severity_score column
+and an optional service_minutes column. Each weight combination sees the
+same arrivals, service times and check-in answers.
+
+Reports wait time percentiles per severity level, clinician utilization,
+and how far the wait estimate shown on arrival was from the actual wait,
+both for the learned estimate the API serves and for a fixed
+WAIT_ESTIMATE_PRIOR_MINUTES per position.
+
+Run this from the backend directory:
+    python simulate_queue.py --days 7 --arrivals-per-hour 12 --clinicians emergency=2,urgent_care=3
+    python simulate_queue.py --wait-weight 0.2,0.3,0.5 --max-wait 60,120
+    python simulate_queue.py --arrivals recorded.csv --output simulation.json
+"""
+
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.priority_index import PriorityIndex, IndexedEntry, EPOCH, to_minutes  # noqa: E402
+from app.queue_manager import SEVERITY_WEIGHT, WAIT_WEIGHT, MAX_WAIT_THRESHOLD_MINUTES  # noqa: E402
+from app.scheduler import CHECK_IN_INTERVAL_MINUTES  # noqa: E402
+from app.triage_logic import DEPARTMENTS, SEVERITY_LEVELS, get_department, get_severity_level  # noqa: E402
+from app.wait_estimator import WaitEstimator, WAIT_ESTIMATE_PRIOR_MINUTES  # noqa: E402
+
+SIMULATION_START = datetime(2024, 1, 1)
+# Relative weight of each severity score among arrivals
+DEFAULT_SEVERITY_MIX = "1:6,2:8,3:10,4:14,5:16,6:14,7:12,8:9,9:6,10:5"
+# Median minutes with a clinician, per level
+DEFAULT_SERVICE_MINUTES = "Critical:45,High:30,Medium:18,Low:10"
+
+
+class Arrival:
+    __slots__ = ("minute", "severity_score", "service_minutes", "seed")
+
+    def __init__(self, minute: float, severity_score: float, service_minutes: float, seed: int):
+        self.minute = minute
+        self.severity_score = severity_score
+        self.service_minutes = service_minutes
+        self.seed = seed  # Drives this patient's check-in answers
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Discrete-event simulation of the MediQueue waiting queue")
+    parser.add_argument("--days", type=float, default=7, help="Simulated days of arrivals")
+    parser.add_argument("--arrivals-per-hour", type=float, default=8, help="Mean Poisson arrival rate")
+    parser.add_argument("--arrivals", help="CSV of recorded arrivals instead of the Poisson stream")
+    parser.add_argument("--severity-mix", default=DEFAULT_SEVERITY_MIX,
+                        help="score:weight pairs for generated arrivals")
+    parser.add_argument("--service-minutes", default=DEFAULT_SERVICE_MINUTES,
+                        help="level:median pairs for time with a clinician")
+    parser.add_argument("--service-sigma", type=float, default=0.5, help="Log-normal spread of service times")
+    parser.add_argument("--clinicians", default="3",
+                        help="Clinicians per department, either one number or department=count pairs")
+    parser.add_argument("--check-in-minutes", type=float, default=CHECK_IN_INTERVAL_MINUTES)
+    parser.add_argument("--worse-probability", type=float, default=0.1,
+                        help="Chance a check-in answer is 'worse'")
+    parser.add_argument("--severity-weight", default=str(SEVERITY_WEIGHT), help="Comma-separated values to try")
+    parser.add_argument("--wait-weight", default=str(WAIT_WEIGHT), help="Comma-separated values to try")
+    parser.add_argument("--max-wait", default=str(MAX_WAIT_THRESHOLD_MINUTES),
+                        help="Comma-separated wait caps in minutes to try")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Where to write the JSON results")
+    return parser.parse_args()
+
+
+def parse_pairs(text: str) -> Dict[str, float]:
+    pairs = {}
+    for item in text.split(","):
+        key, value = item.split(":")
+        pairs[key.strip()] = float(value)
+    return pairs
+
+
+def parse_clinicians(text: str) -> Dict[str, int]:
+    if "=" not in text:
+        return {department: int(text) for department in DEPARTMENTS}
+    clinicians = {department: 0 for department in DEPARTMENTS}
+    for item in text.split(","):
+        department, count = item.split("=")
+        if department.strip() not in clinicians:
+            raise SystemExit(f"Unknown department '{department.strip()}'. Use one of: {', '.join(DEPARTMENTS)}")
+        clinicians[department.strip()] = int(count)
+    return clinicians
+
+
+def parse_values(text: str) -> List[float]:
+    return [float(value) for value in text.split(",")]
+
+
+def service_time(rng: random.Random, level: str, medians: Dict[str, float], sigma: float) -> float:
+    return medians[level] * math.exp(rng.gauss(0, sigma))
+
+
+def generate_arrivals(args, rng: random.Random) -> List[Arrival]:
+    mix = parse_pairs(args.severity_mix)
+    scores = [float(score) for score in mix]
+    weights = list(mix.values())
+    medians = parse_pairs(args.service_minutes)
+    arrivals = []
+    minute = rng.expovariate(args.arrivals_per_hour / 60)
+    while minute < args.days * 24 * 60:
+        severity = rng.choices(scores, weights)[0]
+        service = service_time(rng, get_severity_level(severity), medians, args.service_sigma)
+        arrivals.append(Arrival(minute, severity, service, rng.getrandbits(32)))
+        minute += rng.expovariate(args.arrivals_per_hour / 60)
+    return arrivals
+
+
+def load_arrivals(path: str, args, rng: random.Random) -> List[Arrival]:
+    """Arrivals from a CSV export; created_at timestamps are made relative to the first one"""
+    medians = parse_pairs(args.service_minutes)
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    if rows and "arrival_minutes" not in rows[0]:
+        first = min(datetime.fromisoformat(row["created_at"]) for row in rows)
+        for row in rows:
+            row["arrival_minutes"] = (datetime.fromisoformat(row["created_at"]) - first).total_seconds() / 60
+    arrivals = []
+    for row in sorted(rows, key=lambda row: float(row["arrival_minutes"])):
+        severity = float(row["severity_score"])
+        service = row.get("service_minutes")
+        arrivals.append(Arrival(
+            float(row["arrival_minutes"]), severity,
+            float(service) if service else service_time(rng, get_severity_level(severity), medians,
+                                                         args.service_sigma),
+            rng.getrandbits(32)
+        ))
+    return arrivals
+
+
+def simulate(arrivals: List[Arrival], clinicians: Dict[str, int], severity_weight: float, wait_weight: float,
+             max_wait: float, check_in_minutes: float, worse_probability: float) -> Dict:
+    """Run one policy over the arrivals and collect per-patient outcomes"""
+    start = to_minutes(SIMULATION_START)
+    indexes = {department: PriorityIndex(severity_weight, wait_weight, max_wait) for department in DEPARTMENTS}
+    estimators = {department: WaitEstimator() for department in DEPARTMENTS}
+    free = dict(clinicians)
+    busy_minutes = {department: 0.0 for department in DEPARTMENTS}
+    department_of: Dict[int, str] = {}
+    check_in_rngs: Dict[int, random.Random] = {}
+    outcomes = []
+
+    events = []  # (minute, seq, kind, value)
+    seq = itertools.count()
+    for patient_id, arrival in enumerate(arrivals, start=1):
+        heapq.heappush(events, (start + arrival.minute, next(seq), "arrival", patient_id))
+        outcomes.append({"level": get_severity_level(arrival.severity_score), "escalations": 0})
+
+    def dispatch(department: str, now: float):
+        index = indexes[department]
+        while free[department] > 0 and len(index):
+            entry = index.peek(now)
+            index.remove(entry.entry_id)
+            estimators[department].observe(entry.priority_level, entry.created_at, EPOCH + timedelta(minutes=now))
+            free[department] -= 1
+            service = arrivals[entry.entry_id - 1].service_minutes
+            busy_minutes[department] += service
+            outcomes[entry.entry_id - 1].update(wait=now - entry.created_minutes, started=now - start)
+            heapq.heappush(events, (now + service, next(seq), "done", department))
+
+    now = start
+    while events:
+        now, _, kind, value = heapq.heappop(events)
+        if kind == "arrival":
+            arrival = arrivals[value - 1]
+            level = outcomes[value - 1]["level"]
+            department = get_department(arrival.severity_score, arrival.severity_score >= 9)
+            if not clinicians[department]:  # Department not staffed in this scenario
+                department = next(name for name in DEPARTMENTS if clinicians[name])
+            department_of[value] = department
+            created_at = SIMULATION_START + timedelta(minutes=arrival.minute)
+            index = indexes[department]
+            index.insert(IndexedEntry(value, value, arrival.severity_score, level, created_at), now)
+            snapshot = index.snapshot(now)
+            position = snapshot.positions[value]
+            outcomes[value - 1].update(
+                department=department,
+                estimate=estimators[department].wait_minutes(snapshot, position),
+                fixed_estimate=(position - 1) * WAIT_ESTIMATE_PRIOR_MINUTES,
+            )
+            check_in_rngs[value] = random.Random(arrival.seed)
+            heapq.heappush(events, (now + check_in_minutes, next(seq), "check_in", value))
+            dispatch(department, now)
+        elif kind == "done":
+            free[value] += 1
+            dispatch(value, now)
+        elif kind == "check_in":
+            index = indexes[department_of[value]]
+            entry = index.get(value)
+            if entry is None:
+                continue  # Already with a clinician
+            if check_in_rngs[value].random() < worse_probability and entry.severity_score < 10:
+                # Like update_severity: the score rises, level and department stay as triaged
+                index.insert(IndexedEntry(value, value, min(10, entry.severity_score + 1), entry.priority_level,
+                                          entry.created_at, entry.offset), now)
+                outcomes[value - 1]["escalations"] += 1
+            heapq.heappush(events, (now + check_in_minutes, next(seq), "check_in", value))
+
+    elapsed = now - start
+    return {
+        "outcomes": outcomes,
+        "elapsed_minutes": elapsed,
+        "utilization": {
+            department: round(busy_minutes[department] / (clinicians[department] * elapsed), 3)
+            for department in DEPARTMENTS if clinicians[department] and elapsed
+        },
+    }
+
+
+def wait_stats(waits: List[float]) -> Dict:
+    if not waits:
+        return {"count": 0}
+    ordered = sorted(waits)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 1),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p95": pick(0.95),
+        "max": round(ordered[-1], 1),
+    }
+
+
+def summarize(run: Dict, arrival_minutes: float) -> Dict:
+    outcomes = run["outcomes"]
+    levels = {}
+    for level in list(SEVERITY_LEVELS) + ["All"]:
+        group = [outcome for outcome in outcomes if level in ("All", outcome["level"])]
+        errors = [outcome["wait"] - outcome["estimate"] for outcome in group]
+        fixed_errors = [outcome["wait"] - outcome["fixed_estimate"] for outcome in group]
+        levels[level] = dict(
+            wait_stats([outcome["wait"] for outcome in group]),
+            escalated=sum(1 for outcome in group if outcome["escalations"]),
+            estimate_bias=round(sum(errors) / len(errors), 1) if errors else None,
+            estimate_abs_error=round(sum(abs(error) for error in errors) / len(errors), 1) if errors else None,
+            fixed_estimate_abs_error=(
+                round(sum(abs(error) for error in fixed_errors) / len(fixed_errors), 1) if fixed_errors else None
+            ),
+        )
+    return {
+        "waits": levels,
+        "utilization": run["utilization"],
+        "served_after_arrivals_stopped": sum(1 for outcome in outcomes if outcome["started"] > arrival_minutes),
+        "simulated_hours": round(run["elapsed_minutes"] / 60, 1),
+    }
+
+
+def print_report(policy: Dict, summary: Dict):
+    print(f"\nseverity_weight={policy['severity_weight']} wait_weight={policy['wait_weight']} "
+          f"max_wait={policy['max_wait']}")
+    print(f"{'level':10s} {'count':>6} {'mean':>7} {'p50':>7} {'p90':>7} {'p95':>7} {'max':>7} "
+          f"{'escal.':>6} {'eta bias':>9} {'eta |err|':>9} {'fixed |err|':>11}")
+    for level, stats in summary["waits"].items():
+        if not stats["count"]:
+            continue
+        print(f"{level:10s} {stats['count']:>6} {stats['mean']:>7.1f} {stats['p50']:>7.1f} {stats['p90']:>7.1f} "
+              f"{stats['p95']:>7.1f} {stats['max']:>7.1f} {stats['escalated']:>6} "
+              f"{stats['estimate_bias']:>9.1f} {stats['estimate_abs_error']:>9.1f} "
+              f"{stats['fixed_estimate_abs_error']:>11.1f}")
+    utilization = ", ".join(f"{department} {value:.0%}" for department, value in summary["utilization"].items())
+    print(f"Utilization: {utilization}. Simulated {summary['simulated_hours']} hours, "
+          f"{summary['served_after_arrivals_stopped']} patients seen after arrivals stopped.")
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)  # Index treap shapes
+    rng = random.Random(args.seed)
+    arrivals = load_arrivals(args.arrivals, args, rng) if args.arrivals else generate_arrivals(args, rng)
+    if not arrivals:
+        raise SystemExit("No arrivals to simulate")
+    clinicians = parse_clinicians(args.clinicians)
+    if not any(clinicians.values()):
+        raise SystemExit("At least one department needs a clinician")
+    arrival_minutes = arrivals[-1].minute
+
+    print("=" * 80)
+    print("QUEUE SIMULATION")
+    print("=" * 80)
+    print(f"{len(arrivals)} arrivals over {arrival_minutes / 60:.1f} hours, clinicians: "
+          + ", ".join(f"{department} {count}" for department, count in clinicians.items())
+          + f". Wait times in minutes; eta compares the learned estimate shown on arrival with the actual wait, "
+          f"fixed the old {WAIT_ESTIMATE_PRIOR_MINUTES:g} minutes per position.")
+
+    results = []
+    for severity_weight, wait_weight, max_wait in itertools.product(
+        parse_values(args.severity_weight), parse_values(args.wait_weight), parse_values(args.max_wait)
+    ):
+        policy = {"severity_weight": severity_weight, "wait_weight": wait_weight, "max_wait": max_wait}
+        started = time.perf_counter()
+        run = simulate(arrivals, clinicians, severity_weight, wait_weight, max_wait,
+                       args.check_in_minutes, args.worse_probability)
+        summary = summarize(run, arrival_minutes)
+        summary["runtime_seconds"] = round(time.perf_counter() - started, 2)
+        print_report(policy, summary)
+        results.append({"policy": policy, **summary})
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "timestamp": datetime.utcnow().isoformat(),
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "arrivals": len(arrivals),
+                "results": results,
+            }, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
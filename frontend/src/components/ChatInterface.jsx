@@ -1,11 +1,13 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { sendMessage } from '../services/api';
+import websocketService from '../services/websocket';
 import './ChatInterface.css';
 
 const ChatInterface = ({ sessionId, onTriageComplete, disabled }) => {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
+  const [streamingText, setStreamingText] = useState('');
   const messagesEndRef = useRef(null);
 
   useEffect(() => {
@@ -16,9 +18,16 @@ const ChatInterface = ({ sessionId, onTriageComplete, disabled }) => {
     }]);
   }, []);
 
+  useEffect(() => {
+    // Partial assistant replies arrive over the WebSocket while the request is pending
+    const handleChunk = (data) => setStreamingText((text) => text + data.content);
+    websocketService.on('message_chunk', handleChunk);
+    return () => websocketService.off('message_chunk', handleChunk);
+  }, []);
+
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [messages, streamingText]);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -31,13 +40,14 @@ const ChatInterface = ({ sessionId, onTriageComplete, disabled }) => {
     const userMessage = input.trim();
     setInput('');
     setLoading(true);
+    setStreamingText('');
 
     // Add user message to UI
     const newMessages = [...messages, { role: 'user', content: userMessage }];
     setMessages(newMessages);
 
     try {
-      const response = await sendMessage(sessionId, userMessage);
+      const response = await sendMessage(sessionId, userMessage, true);
       setMessages([...newMessages, { role: 'assistant', content: response.response }]);
     } catch (error) {
       console.error('Error sending message:', error);
@@ -47,6 +57,7 @@ const ChatInterface = ({ sessionId, onTriageComplete, disabled }) => {
       }]);
     } finally {
       setLoading(false);
+      setStreamingText('');
     }
   };
 
@@ -61,7 +72,7 @@ const ChatInterface = ({ sessionId, onTriageComplete, disabled }) => {
         {loading && (
           <div className="message assistant">
             <div className="message-content">
-              <span className="typing-indicator">...</span>
+              {streamingText || <span className="typing-indicator">...</span>}
             </div>
           </div>
         )}
@@ -1,21 +1,28 @@
 import React, { useState, useEffect } from 'react';
-import { getQueue, lowerPosition } from '../services/api';
+import { getMyQueuePosition, lowerPosition, withWaitTimes } from '../services/api';
+import websocketService from '../services/websocket';
 import './QueueDisplay.css';
 
+const DEPARTMENT_LABELS = {
+  emergency: 'Emergency',
+  urgent_care: 'Urgent Care',
+};
+
 const QueueDisplay = ({ sessionId, userId, queuePosition }) => {
-  const [queue, setQueue] = useState([]);
+  const [myPosition, setMyPosition] = useState(null);
   const [loading, setLoading] = useState(false);
 
   useEffect(() => {
     loadQueue();
-    const interval = setInterval(loadQueue, 5000); // Refresh every 5 seconds
-    return () => clearInterval(interval);
+    // Live position changes arrive over the WebSocket
+    const handlePositionUpdate = (data) => setMyPosition(data);
+    websocketService.on('queue_position', handlePositionUpdate);
+    return () => websocketService.off('queue_position', handlePositionUpdate);
   }, []);
 
   const loadQueue = async () => {
     try {
-      const data = await getQueue();
-      setQueue(data.queue || []);
+      setMyPosition(await getMyQueuePosition(sessionId));
     } catch (error) {
       console.error('Error loading queue:', error);
     }
@@ -52,7 +59,7 @@ const QueueDisplay = ({ sessionId, userId, queuePosition }) => {
     return 'Low';
   };
 
-  const userQueueEntry = queue.find((entry) => entry.user_id === userId);
+  const userQueueEntry = myPosition && myPosition.position !== null ? withWaitTimes([myPosition])[0] : null;
 
   return (
     <div className="queue-display">
@@ -68,6 +75,10 @@ const QueueDisplay = ({ sessionId, userId, queuePosition }) => {
 
       {userQueueEntry && (
         <div className="user-queue-info">
+          <div className="info-item">
+            <span className="info-label">Queue:</span>
+            <span>{DEPARTMENT_LABELS[userQueueEntry.department] || userQueueEntry.department}</span>
+          </div>
           <div className="info-item">
             <span className="info-label">Severity:</span>
             <span
@@ -91,32 +102,20 @@ const QueueDisplay = ({ sessionId, userId, queuePosition }) => {
         </div>
       )}
 
-      <div className="queue-list">
-        <div className="queue-list-header">
-          <span>Position</span>
-          <span>Severity</span>
-          <span>Wait Time</span>
+      {userQueueEntry ? (
+        <div className="queue-list">
+          <div className="info-item">
+            <span className="info-label">People ahead of you:</span>
+            <span>{userQueueEntry.ahead}</span>
+          </div>
+          <div className="info-item">
+            <span className="info-label">Estimated wait:</span>
+            <span>{userQueueEntry.estimated_wait_minutes} minutes</span>
+          </div>
         </div>
-        {queue.length === 0 ? (
-          <div className="empty-queue">No one in queue</div>
-        ) : (
-          queue.map((entry) => (
-            <div
-              key={entry.user_id}
-              className={`queue-item ${entry.user_id === userId ? 'current-user' : ''}`}
-            >
-              <span className="queue-position">{entry.position}</span>
-              <span
-                className="queue-severity"
-                style={{ color: getSeverityColor(entry.severity_score) }}
-              >
-                {getSeverityLabel(entry.severity_score)}
-              </span>
-              <span className="queue-wait">{Math.round(entry.wait_time_minutes)}m</span>
-            </div>
-          ))
-        )}
-      </div>
+      ) : (
+        <div className="empty-queue">You are not in the queue</div>
+      )}
     </div>
   );
 };
@@ -31,10 +31,11 @@ export const startTriage = async (name, phone) => {
   }
 };
 
-export const sendMessage = async (sessionId, content) => {
+export const sendMessage = async (sessionId, content, stream = false) => {
   const response = await api.post('/api/message', {
     session_id: sessionId,
     content,
+    stream,
   });
   return response.data;
 };
@@ -42,12 +43,28 @@ export const sendMessage = async (sessionId, content) => {
 export const completeTriage = async (sessionId) => {
   const response = await api.post('/api/complete-triage', {
     session_id: sessionId,
+    // One completion per session, so retries of it replay the first result
+    request_id: `complete-${sessionId}`,
   });
   return response.data;
 };
 
-export const getQueue = async () => {
-  const response = await api.get('/api/queue');
+// Queue entries carry created_at (UTC); wait times are derived locally
+export const withWaitTimes = (queue) => {
+  const now = Date.now();
+  return queue.map((entry) => ({
+    ...entry,
+    wait_time_minutes: Math.max(0, (now - Date.parse(`${entry.created_at}Z`)) / 60000),
+  }));
+};
+
+export const getQueue = async (department) => {
+  const response = await api.get('/api/queue', { params: { department } });
+  return { ...response.data, queue: withWaitTimes(response.data.queue || []) };
+};
+
+export const getMyQueuePosition = async (sessionId) => {
+  const response = await api.get('/api/queue/me', { params: { session_id: sessionId } });
   return response.data;
 };
 
@@ -1,16 +1,30 @@
 import ReconnectingWebSocket from 'reconnecting-websocket';
+import { withWaitTimes } from './api';
 
 class WebSocketService {
   constructor() {
     this.ws = null;
+    // Queue rebuilt from queue_snapshot / queue_delta messages
+    this.queue = [];
+    this.queueSeq = null;
+    // Set while a queue_resync is unanswered, so a burst past a gap asks only once
+    this.resyncPending = false;
+    this.waitEstimate = null;
     this.callbacks = {
       queue_update: [],
+      queue_position: [],
       check_in: [],
+      message_chunk: [],
+      message_complete: [],
     };
   }
 
-  connect(sessionId) {
-    const wsUrl = import.meta.env.VITE_WS_URL || `ws://localhost:8000/ws/${sessionId}`;
+  // view 'me' gets the patient's own position; 'full' (staff) gets one department's whole queue
+  connect(sessionId, { view = 'me', token, department } = {}) {
+    const params = new URLSearchParams({ view });
+    if (token) params.set('token', token);
+    if (department) params.set('department', department);
+    const wsUrl = `${import.meta.env.VITE_WS_URL || `ws://localhost:8000/ws/${sessionId}`}?${params}`;
     this.ws = new ReconnectingWebSocket(wsUrl);
 
     this.ws.addEventListener('message', (event) => {
@@ -23,6 +37,9 @@ class WebSocketService {
     });
 
     this.ws.addEventListener('open', () => {
+      // The server sends a fresh snapshot on every (re)connect
+      this.queueSeq = null;
+      this.resyncPending = false;
       console.log('WebSocket connected');
     });
 
@@ -37,11 +54,44 @@ class WebSocketService {
 
   handleMessage(data) {
     const { type } = data;
+    if (type === 'queue_snapshot' || type === 'queue_delta') {
+      this.handleQueueMessage(data);
+      return;
+    }
     if (this.callbacks[type]) {
       this.callbacks[type].forEach((callback) => callback(data));
     }
   }
 
+  handleQueueMessage(data) {
+    if (data.type === 'queue_snapshot') {
+      this.queue = data.queue;
+    } else {
+      if (this.queueSeq === null || data.seq <= this.queueSeq) {
+        return; // Waiting for a snapshot, or already applied
+      }
+      if (data.seq !== this.queueSeq + 1) {
+        // Missed an update: ask for the deltas since the last one applied
+        if (!this.resyncPending) {
+          this.resyncPending = true;
+          this.ws.send(JSON.stringify({ type: 'queue_resync', since: this.queueSeq }));
+        }
+        return;
+      }
+      this.queue = applyQueueDelta(this.queue, data);
+    }
+    // Back in sequence: the snapshot or replayed deltas answered any resync
+    this.queueSeq = data.seq;
+    this.resyncPending = false;
+    // Learned minutes per patient, overall and by level, for estimating waits
+    this.waitEstimate = data.wait_estimate;
+
+    const queue = withWaitTimes(this.queue);
+    this.callbacks.queue_update.forEach((callback) => callback({
+      type: 'queue_update', seq: data.seq, queue, wait_estimate: this.waitEstimate,
+    }));
+  }
+
   on(event, callback) {
     if (this.callbacks[event]) {
       this.callbacks[event].push(callback);
@@ -62,5 +112,22 @@ class WebSocketService {
   }
 }
 
+// Entries not mentioned in a delta keep their relative order; everything
+// else is spliced back in at its new position, lowest position first.
+function applyQueueDelta(queue, delta) {
+  const byId = new Map(queue.map((entry) => [entry.queue_entry_id, entry]));
+  const placed = [
+    ...delta.inserted,
+    ...delta.updated,
+    ...delta.moved.map(([id, position]) => ({ ...byId.get(id), position })),
+  ];
+  const drop = new Set([...delta.removed, ...placed.map((entry) => entry.queue_entry_id)]);
+  const next = queue.filter((entry) => !drop.has(entry.queue_entry_id));
+  placed
+    .sort((a, b) => a.position - b.position)
+    .forEach((entry) => next.splice(entry.position - 1, 0, entry));
+  return next.map((entry, i) => ({ ...entry, position: i + 1 }));
+}
+
 export default new WebSocketService();
 